@@ -6,8 +6,24 @@ import importlib
 import analyze
 import re
 import glob
+import os
+import csv
+import platform
+import itertools
+import array
+import copy
+import io
+import contextlib
+import multiprocessing
+import cache
+import latency
+import lockstats
+import records
 import student
 
+try:                import numpy                 # Optional.  Missing/duplicate counting is vectorized when it's there.
+except ImportError: numpy = None
+
 TARGET_OOO = 10  # This isn't a real meaningful target.  It's 'global' to this file for convenience, but buffer.py will try to make it a more meaningful value based on the environment.
 
 
@@ -128,9 +144,10 @@ class config_object():
 
     # Make the output names consistant by building from the config name and key
     # Sometimes the caller wants a run number added to name. 
-    def filename(self, dir, run_num=None):
-        if run_num: return "%s/%s_r%d.txt" % (dir, self.name_and_key, run_num)
-        else:       return "%s/%s.txt"     % (dir, self.name_and_key)
+    # ext picks the output format, see records.py
+    def filename(self, dir, run_num=None, ext=records.TEXT_EXT):
+        if run_num: return "%s/%s_r%d%s" % (dir, self.name_and_key, run_num, ext)
+        else:       return "%s/%s%s"     % (dir, self.name_and_key, ext)
 
 
     # Queue a run to be added later.  Note that it's a tuple so it's easy to pull the parts back off the queue.
@@ -143,27 +160,69 @@ class config_object():
     # Walk the queue, adding all the queued runs.  
     def add_queued(self, print_results=True):
         for (outfile, killed, graph, print_details, print_section_start) in self.queue:
-            self.add_run(outfile, killed, graph, print_details, print_section_start)
+            self.add_run(outfile, killed, graph, print_details, print_section_start, latency_file=queued_latency_file(outfile), cached=True)
         if print_results: self.print_all_run_results()
 
 
+    # A copy with no runs or queue, to hand to a worker process.  Pickling the real one would ship its whole queue with every file.
+    def worker_copy(self):
+        config             = copy.copy(self)
+        config.runs        = []
+        config.queue       = []
+        config.total_stats = run_stats()
+        return config
+
+
     # Adds a run to the config, printing info about it as it works thru the analysis
-    def add_run(self, outfile, killed, graph, print_details, print_section_start):
+    # With cached, an unchanged file that was analyzed before comes from the analysis cache (see cache.py) instead of being read again
+    def add_run(self, outfile, killed, graph, print_details, print_section_start, timing=None, latency_file=None, plot=False, cached=False):
         if (print_section_start): print(SECTION_START)    # Output section start, if needed
         print("%s %s" % (label("> " + self.name + " <", colon=False), "key = %s" % self.key))
         print("%s %s" % (label("Analyzing"), outfile))
-        results = run_results_object(outfile, killed, graph, print_details, print_section_start)    # Get the run results
+        entry   = cache.entry_object(outfile, killed) if cached and not (graph or plot) else None    # Graphed runs need the plot data, which isn't cached
+        fields  = entry.load() if entry else None
+        results = None
+        if fields is not None:
+            try:              results = run_results_object(outfile, killed, graph, print_details, print_section_start, plot, fields)
+            except Exception: results = None                # An entry that doesn't hold what cache_fields writes, just a miss
+        if results is None:
+            results = run_results_object(outfile, killed, graph, print_details, print_section_start, plot)    # Get the run results
+            if entry: entry.store(results.cache_fields())
+        results.timing = timing                           # Timing is only known when the run was just executed, not when analyzing old output
+        results.queueing = results.end_to_end = None      # Per-item latencies (ns), only when the run was recorded with -L
+        if latency_file: results.queueing, results.end_to_end = latency.read_latency_file(latency_file)
         self.runs.append(results)                         # Append the run to the list of runs
 
         if print_details: 
             results.print_details(print_section_start)
+        if timing:
+            print("--------------------------------------------------------------------------------------------------")
+            print("%s %s" % (label("Timing"), timing.as_str(results.items)))
+        if timing and timing.locks:
+            print("--------------------------------------------------------------------------------------------------")
+            timing.locks.print_report(label("Locks"))
+        if timing and timing.slots:
+            print("--------------------------------------------------------------------------------------------------")
+            print("%s %s" % (label("Slots"), timing.slots_str()))
+        if results.queueing is not None:
+            print("--------------------------------------------------------------------------------------------------")
+            print("%s %s" % (label("Queue latency"), latency.as_str(results.queueing)))
+            print("%s %s" % (label("End-to-end"),    latency.as_str(results.end_to_end)))
         print(SECTION_END)                                # Output section break ending
 
         if graph: results.show_graph()                    # If the caller wants graphed, show the graph
+        results.release_details(keep_plot=plot and not graph)    # Printed (and graphed), so only the counters stay.  A worker's plot data still has to get to the parent.
         self.total_stats.add(results.percents)            # Add the run to the running stats total
         return results                                    # Return the analyzed run stats to the caller
 
 
+    # Adds a run that was already analyzed somewhere else (e.g., in a worker process) without re-reading the file or printing
+    def merge_run(self, results):
+        self.runs.append(results)                         # Append the run to the list of runs
+        self.total_stats.add(results.percents)            # Add the run to the running stats total
+        return results
+
+
     # Runs index numbers are one off, since they are logical (not zero-based)
     def return_run_percents(self, run=None):
         if run: return self.runs[run-1].percents
@@ -176,6 +235,59 @@ class config_object():
         print("%s > %s <   (run %d)" % (label("Test-%d" % overall), self.name, run))
 
 
+    # Per engine, the combined wall time and throughput of the timed runs, so engines run on the same config line up
+    # (e.g., -B runs p1_c1 SPSC configs on the blocking engine too), each one after the first also as a ratio to it.
+    # Then where -e adaptive left the capacity, and the queueing latency percentiles across every run recorded with -L.
+    def print_timing_summary(self):
+        by_engine = {}
+        for run in self.runs:
+            if getattr(run, "timing", None):
+                by_engine.setdefault(run.timing.engine, []).append(run)
+        queueing = self.queueing()
+        if not by_engine and queueing is None: return
+        finals   = [run.timing.slots[-1][1] for run in self.runs if getattr(run, "timing", None) and run.timing.slots]
+
+        print("--------------------------------------------------------------------------------------------------")
+        first = None                                     # (engine, items/sec) of the first engine, the others are compared to it
+        for name in by_engine:
+            runs  = by_engine[name]
+            wall  = sum([r.timing.wall for r in runs])
+            items = sum([r.items       for r in runs])
+            rate  = percent(items, wall) / 100
+            if first is None: first, versus = (name, rate), ""
+            else:             versus = "   %6.2fx %s" % (rate / first[1], first[0]) if first[1] else ""
+            print("%s engine=%-10s runs=%3d   wall=%8.4fs   items/sec=%12.1f%s" % (label("Throughput"), name, len(runs), wall, rate, versus))
+        if finals:
+            print("%s final capacity per run: %s   (started at %d)" % (label("Slots"), " ".join([str(f) for f in finals]), self.slots))
+        if queueing is not None:
+            print("%s %s" % (label("Queue latency"), latency.as_str(queueing)))
+
+
+    # Lock profiles of every run profiled with -P, added together.  Returns (profile, runs), or (None, 0) if none were.
+    def lock_profile(self):
+        profiles = [run.timing.locks for run in self.runs if getattr(run, "timing", None) and run.timing.locks]
+        if not profiles: return None, 0
+        total = lockstats.profile_object()
+        for profile in profiles: total.add(profile)
+        return total, len(profiles)
+
+
+    # Per lock and per thread wait/hold times across the profiled runs, so the critical section to shrink stands out
+    def print_lock_profile(self):
+        profile, runs = self.lock_profile()
+        if not profile: return
+        print("--------------------------------------------------------------------------------------------------")
+        print("%s %d profiled runs" % (label("Lock profile"), runs))
+        profile.print_report(label("Locks"), per_thread=True)
+
+
+    # Every recorded queueing latency (ns) across this config's runs, or None if no run was recorded with -L
+    def queueing(self):
+        recorded = [run.queueing for run in self.runs if getattr(run, "queueing", None) is not None]
+        if not recorded: return None
+        return [ns for run in recorded for ns in run]
+
+
     def print_all_run_results(self, even_one_only=False, one_liners_only=False):
         if len(self.runs) > 1 or even_one_only:
             if not one_liners_only:
@@ -198,34 +310,177 @@ class config_object():
                 print("--------------------------------------------------------------------------------------------------")
                 print("%s" % self.total_stats.main_data_as_str())
 
+            if not one_liners_only:
+                self.print_timing_summary()
+                self.print_lock_profile()
+
             if not one_liners_only:
                 print("===========================================================================================================================================================================================\n\n\n\n\n")
 
 
 
 
-# Class to do the actual analysis of a single run
+# The latency side file for an output file, if the run was recorded with -L (and the output file hasn't been rewritten since)
+def queued_latency_file(outfile):
+    return latency.matching_latency_file(outfile)
+
+
+# Worker side of add_queued_in_pool: analyze one queued run exactly like add_queued would, capturing what it prints
+# so the parent can replay it in order.  Graphs are never shown from a worker, the parent does that after merging.
+def analyze_queued(task):
+    global TARGET_OOO
+    config, (outfile, killed, graph, print_details, print_section_start), TARGET_OOO, cache_settings = task
+    cache.configure(*cache_settings)
+    text = io.StringIO()
+    with contextlib.redirect_stdout(text):
+        results = config.add_run(outfile, killed, False, print_details, print_section_start, latency_file=queued_latency_file(outfile), plot=graph, cached=True)
+    return text.getvalue(), results
+
+
+# add_queued for every config in 'configs', with the runs analyzed across 'jobs' worker processes.  Results come back in
+# queue order (imap, not imap_unordered), so the output, summaries and grade are the same as calling add_queued on each.
+def add_queued_in_pool(configs, jobs):
+    tasks = [(config.worker_copy(), queued, TARGET_OOO, cache.settings()) for config in configs for queued in config.queue]
+    owner = [config for config in configs for queued in config.queue]
+    if tasks:
+        with multiprocessing.Pool(min(jobs, len(tasks))) as pool:
+            for i, (text, results) in enumerate(pool.imap(analyze_queued, tasks, chunksize=max(1, len(tasks) // (jobs * 16)))):
+                config = owner[i]
+                sys.stdout.write(text)                        # Replay what the worker printed for this run
+                config.merge_run(results)                     # Merge into the parent's config, same as add_run would have
+                if tasks[i][1][2]: results.show_graph()
+                results.release_details()
+                if i+1 == len(tasks) or owner[i+1] is not config:
+                    config.print_all_run_results()
+    for config in configs:
+        if not config.queue: config.print_all_run_results()   # Same as add_queued on a config with nothing queued
+
+
+
+# counts[item] += 1 for each item in 'items' (all in range).  Output is mostly in order, so a block's items usually
+# cover a short span and one bincount over the span does it, otherwise add.at.
+def add_counts_with_numpy(counts, items):
+    if not len(items): return
+    low, high = int(items.min()), int(items.max())
+    items = items.astype(numpy.int64)    # An object array from records.text_block_rows, its valid items all fit
+    if high - low < 4 * len(items): counts[low:high+1] += numpy.bincount(items - low, minlength=high-low+1).astype(counts.dtype)
+    else:                           numpy.add.at(counts, items, 1)
+
+
+# A detail list of run_results_object (missing_items, ...) kept in the '_' slot of the same name.  Once release_details
+# has dropped it (None), reading it analyzes the output file again to rebuild it.
+def lazy_detail(name):
+    slot = "_" + name
+    def get(self):
+        if getattr(self, slot) is None: self.reload_details(plot=(name == "y_vals"))
+        return getattr(self, slot)
+    def set(self, value):
+        setattr(self, slot, value)
+    return property(get, set)
+
+
+# Class to do the actual analysis of a single run.
+# The output file is streamed once, and only per-item counts are kept, so memory doesn't grow with the file size.
+# The plot data (y_vals) is only kept when the run will be graphed (-m).  plot asks for it without graphing right
+# away, for a worker process whose results the parent graphs.
+#
+# Every run of every config is kept until the end, so a run only keeps counters, in __slots__.  The detail lists,
+# which can be as long as the run, are dropped by release_details once add_run has printed (and graphed) them, so a
+# whole sweep needs about the memory of its largest run.  Anything that reads one afterwards gets it rebuilt from the file.
 class run_results_object():
-    def __init__(self, outfile, killed, graph, print_details, print_section_start):
+    __slots__ = ("filename", "plot", "cached", "producers", "consumers", "slots", "num_expected", "run_num",
+                 "items", "ooo_count", "max_prod", "max_cons", "producer_counts", "consumer_counts", "num_idle_producers", "num_idle_consumers",
+                 "num_missing", "num_duplicates", "num_invalid", "percents", "timing", "queueing", "end_to_end",
+                 "expected_counts", "_missing_items", "_duplicate_items", "_invalid_items", "_y_vals")
+
+    missing_items   = lazy_detail("missing_items")       # Expected items not in the output, in order
+    duplicate_items = lazy_detail("duplicate_items")     # item -> times it was in the output, for items there more than once
+    invalid_items   = lazy_detail("invalid_items")       # item -> times it was in the output, for items outside 1..num_expected
+    y_vals          = lazy_detail("y_vals")              # The items in output order, for plotting
+
+    def __init__(self, outfile, killed, graph, print_details, print_section_start, plot=False, fields=None):
         self.filename = outfile
+        self.plot     = graph or plot
+        self.cached   = fields is not None   # From the analysis cache, fields is what cache_fields gave when it was stored
+        self.timing   = None                 # Set by add_run, see there
+        self.queueing = self.end_to_end = None
         self.producers, self.consumers, self.slots, self.num_expected, self.run_num = parts_from_filename(outfile)
-
-        # Create an internal list of the expected items.  Will be used during compares and analysis of run.
-        self.expected_list = []
-        for i in range(1,self.num_expected+1):
-            self.expected_list.append(i)
+        if self.cached:
+            self.set_cache_fields(fields)
+            return
 
         read_kill = self.read_file_calc_prod_cons_and_ooo()   # Does the main reading of the file, initial value setting
         self.calc_missing_dups_and_invalid()                      # After initial read, now set the missing, dups, etc.
+        self.expected_counts = None                               # Only needed for the line above.  Runs are kept (and sent back from workers), keep them small.
         self.percents = run_stats(True, self.num_missing, self.num_duplicates, self.num_invalid, self.num_expected, self.ooo_count, self.items, read_kill or killed,
                             self.producers, self.num_idle_producers, self.consumers, self.num_idle_consumers)
 
 
-    # Want to default 'bad' or 'missing' data to zero
-    def get_part(self, parts, offset):
-        try:              val = int(parts[offset])    # Can fail if offset too large, or data no a string that can be turned into an int
-        except Exception: val = 0                     # On any error, just set the part to zero
-        return val
+    # The expected items, 1 thru num_expected.  A range, so 'in' is arithmetic instead of a scan.
+    @property
+    def expected_list(self):
+        return range(1, self.num_expected+1)
+
+
+    # The number of items read to each point is the X value for plotting
+    @property
+    def x_vals(self):
+        return range(1, self.items+1)
+
+
+    # Drop the detail lists once they've been printed.  keep_plot holds on to y_vals for a graph still to be shown.
+    def release_details(self, keep_plot=False):
+        self._missing_items = self._duplicate_items = self._invalid_items = None
+        if not keep_plot: self._y_vals = None
+
+
+    # Analyze the file again for the detail lists release_details dropped.  Counts stay as they were, even if the file changed since.
+    def reload_details(self, plot=False):
+        fresh = run_results_object(self.filename, False, False, False, False, plot)
+        self._missing_items, self._duplicate_items, self._invalid_items = fresh._missing_items, fresh._duplicate_items, fresh._invalid_items
+        if plot: self._y_vals = fresh._y_vals
+
+
+    # The counters and detail lists as plain ints and lists, counts dicts as [key, count] pairs (JSON keys are only
+    # strings), for the analysis cache.  Nothing in there can run code when it's read back, unlike a pickle.
+    def cache_fields(self):
+        return {"items":              self.items,
+                "ooo_count":          self.ooo_count,
+                "max_prod":           self.max_prod,
+                "max_cons":           self.max_cons,
+                "producer_counts":    list(self.producer_counts.items()),
+                "consumer_counts":    list(self.consumer_counts.items()),
+                "num_idle_producers": self.num_idle_producers,
+                "num_idle_consumers": self.num_idle_consumers,
+                "num_missing":        self.num_missing,
+                "num_duplicates":     self.num_duplicates,
+                "num_invalid":        self.num_invalid,
+                "killed":             self.percents.killed.count,
+                "missing_items":      list(self.missing_items),
+                "duplicate_items":    list(self.duplicate_items.items()),
+                "invalid_items":      list(self.invalid_items.items())}
+
+
+    # The other way around.  Anything missing or of the wrong type raises, which the cache takes as a miss.
+    def set_cache_fields(self, fields):
+        self.items              = int(fields["items"])
+        self.ooo_count          = int(fields["ooo_count"])
+        self.max_prod           = int(fields["max_prod"])
+        self.max_cons           = int(fields["max_cons"])
+        self.producer_counts    = dict([(int(key), int(count)) for key, count in fields["producer_counts"]])
+        self.consumer_counts    = dict([(int(key), int(count)) for key, count in fields["consumer_counts"]])
+        self.num_idle_producers = int(fields["num_idle_producers"])
+        self.num_idle_consumers = int(fields["num_idle_consumers"])
+        self.num_missing        = int(fields["num_missing"])
+        self.num_duplicates     = int(fields["num_duplicates"])
+        self.num_invalid        = int(fields["num_invalid"])
+        self._missing_items     = [int(item) for item in fields["missing_items"]]
+        self._duplicate_items   = dict([(int(item), int(count)) for item, count in fields["duplicate_items"]])
+        self._invalid_items     = dict([(int(item), int(count)) for item, count in fields["invalid_items"]])
+        self._y_vals            = None
+        self.expected_counts    = None
+        self.percents = run_stats(True, self.num_missing, self.num_duplicates, self.num_invalid, self.num_expected, self.ooo_count, self.items, bool(fields["killed"]),
+                            self.producers, self.num_idle_producers, self.consumers, self.num_idle_consumers)
 
 
     def out_of_order(self, prev, current, items):
@@ -237,67 +492,107 @@ class run_results_object():
         return res
 
 
+    # (item, producer, consumer) for each record in the output file, for count_rows (no NumPy).  See records.py for both formats.
+    def output_rows(self):
+        if records.is_binary(self.filename): return records.binary_rows(self.filename)
+        else:                                return self.text_rows()
+
+
+    def text_rows(self):
+        f = open(self.filename, 'r')         # open the file to analyze
+        for line in f:                       # One line at a time, never the whole file
+            yield records.text_row(line)
+        f.close()
+
+
     def read_file_calc_prod_cons_and_ooo(self):
-        killed               = False         # Note if find KILLED tuple in output
-        prev                 = None          # used to help determine out of order
         self.items           = 0             # number of items found in output
         self.ooo_count       = 0             # number of out of order items
 
-        self.x_vals          = []            # list of items for ploting
-        self.y_vals          = []            # value of items for ploting
-        self.output_list     = []            # list of items found in the output
+        self._y_vals         = [] if self.plot else None     # value of items for ploting
 
-        self.item_counts     = {}            # items can be duplicated, keep a count of the number of times an item is found
+        self.expected_counts = array.array('I', [0]) * (self.num_expected+1)   # items can be duplicated, times each item 1..num_expected was found (index 0 unused)
+        self._invalid_items  = {}            # same for items outside 1..num_expected, in the order they first showed up
         self.producer_counts = {}            # keep track of the number of items produced by each producer
         self.consumer_counts = {}            # keep track of the number of items consumed by each consumer
 
         self.max_prod = self.producers       # We might find a producer higher than expected, get ready to capture that as we go, use later
         self.max_cons = self.consumers       # We might find a consumer higher than expected, get ready to capture that as we go, use later
 
-        f = open(self.filename, 'r')         # open the file to analyze
-        for line in f.readlines():
-            parts = line.strip().split()     # The output should be a 'tuple' of  'item <tab> producer <tab> consumer'
-            item  = self.get_part(parts, 0)  # item should be in first position, 0
+        if numpy is not None: killed = self.count_blocks_with_numpy()   # Same counts, a block of records at a time
+        else:                 killed = self.count_rows()
+
+        self.num_idle_producers = 0
+        for p in range(1, self.max_prod+1):
+            number, percentage = self.num_percent(self.producer_counts, p, self.items)  # Find count, return it and it's percent
+            if number == 0: self.num_idle_producers +=1  # This producer didn't produce anything, increment the idle count
+
+        self.num_idle_consumers = 0
+        for c in range(1, self.max_cons+1):
+            number, percentage = self.num_percent(self.consumer_counts, c, self.items)  # Find count, return it and it's percent
+            if number == 0: self.num_idle_consumers +=1  # This consumer didn't consumer anything, increment the idle count
+
+        return killed
 
+
+    # The main read loop, one record at a time.  Returns True if the output has a KILLED tuple.
+    def count_rows(self):
+        killed          = False              # Note if find KILLED tuple in output
+        prev            = None               # used to help determine out of order
+        expected_counts = self.expected_counts
+        num_expected    = self.num_expected
+        invalid_items   = self._invalid_items
+        y_vals          = self._y_vals
+        for item, prod, cons in self.output_rows():
             if item < 0:                     # buffer.py tries to capture keyboard interrupts and place a -1,-1,-1 tuple in the output if it happens.
                 killed = True                # Mark this run as 'KILLED'
                 continue                     # but don't add this line to the stats
 
             self.items += 1
 
-            if len(parts) > 3:
-                # A corrupt output line, like no file lock.  Even though there may be partially good data, including the 'item', mark the entire row as bad by setting item to 0 (e.g., invalid).
-                item = 0
-
-            prod = self.get_part(parts, 1)   # get producer.  I've run this code on previous labs, where it wasn't a tuple in the output.  So, default missing to zero.
-            cons = self.get_part(parts, 2)   # get consumer.  I've run this code on previous labs, where it wasn't a tuple in the output.  So, default missing to zero.
-
-            self.add_one(self.item_counts,     item)        # Add one to the item     counts for this 'item'
+            if 0 < item <= num_expected: expected_counts[item] += 1             # Add one to the item counts for this 'item'
+            else:                        self.add_one(invalid_items, item)
             self.add_one(self.producer_counts, prod)        # Add one to the producer counts for this 'producer'
             self.add_one(self.consumer_counts, cons)        # Add one to the consumer counts for this 'consumer'
 
             if prod > self.max_prod: self.max_prod = prod   # Due to command line overrides, or failures, may find a higher producer than expected.  Keep that info.
             if cons > self.max_cons: self.max_cons = cons   # Due to command line overrides, or failures, may find a higher consumer than expected.  Keep that info.
 
-            self.output_list.append(item)    # Add item read to list
-            self.x_vals.append(self.items)   # Use the number of items read to this point as the X value for plotting...
-            self.y_vals.append(item)         # ... and the item itself as the Y value
+            if y_vals is not None: y_vals.append(item)      # The item itself as the Y value for plotting
             if self.out_of_order(prev, item, self.items):   # if out of order...
                 self.ooo_count+=1            # update ooo count
             prev = item                      # Set prev for next time thru loop
+        return killed
 
-        f.close()
-
-        self.num_idle_producers = 0
-        for p in range(1, self.max_prod+1):
-            number, percentage = self.num_percent(self.producer_counts, p, self.items)  # Find count, return it and it's percent
-            if number == 0: self.num_idle_producers +=1  # This producer didn't produce anything, increment the idle count
-
-        self.num_idle_consumers = 0
-        for c in range(1, self.max_cons+1):
-            number, percentage = self.num_percent(self.consumer_counts, c, self.items)  # Find count, return it and it's percent
-            if number == 0: self.num_idle_consumers +=1  # This consumer didn't consumer anything, increment the idle count
 
+    # count_rows for whole blocks of records (see records.output_blocks), with the same rules done as array operations.
+    # Only invalid items are still looked at one by one, so invalid_items keeps its first-seen order.
+    def count_blocks_with_numpy(self):
+        killed = False
+        prev   = None                        # Last item of the previous block, for out of order across blocks
+        counts = numpy.frombuffer(self.expected_counts, dtype=numpy.uintc)     # Writable view, counts[item]
+        for items, prods, conss in records.output_blocks(self.filename):
+            live = items >= 0                # KILL rows are noted, but not added to the stats
+            if not live.all():
+                killed = True
+                items, prods, conss = items[live], prods[live], conss[live]
+            if not len(items): continue
+            self.items += len(items)
+
+            valid = (items > 0) & (items <= self.num_expected)
+            add_counts_with_numpy(counts, items[valid])
+            for item in items[~valid].tolist(): self.add_one(self._invalid_items, item)
+            for counts_by, column in ((self.producer_counts, prods), (self.consumer_counts, conss)):
+                values, times = numpy.unique(column, return_counts=True)
+                for value, count in zip(values.tolist(), times.tolist()): counts_by[value] = counts_by.get(value, 0) + count
+            self.max_prod = max(self.max_prod, int(prods.max()))
+            self.max_cons = max(self.max_cons, int(conss.max()))
+
+            if self._y_vals is not None: self._y_vals.extend(items.tolist())
+            before = items[:-1] if prev is None else numpy.concatenate(([prev], items[:-1]))     # The item before each one
+            after  = items[1:]  if prev is None else items
+            self.ooo_count += int(numpy.count_nonzero((before > 0) & (before != after) & (before + 1 != after)))   # out_of_order()
+            prev = items[-1]
         return killed
 
 
@@ -306,32 +601,39 @@ class run_results_object():
         except Exception: a_dict[key]  = 1   # Otherwise, set value at key to one.
 
 
-    # Using expected_list, determine what's missing or duplicated in the output
+    # Using expected_list, determine what's missing or duplicated in the output.
+    # Linear time: expected_counts has how often each expected item showed up, so an item is missing exactly when its count
+    # is zero.  Missing and duplicate items come out in expected_list order.  Invalid items are already counted in
+    # invalid_items, in the order they first appeared, just like a walk thru the output would find them.
     def calc_missing_dups_and_invalid(self):
-        self.missing_items   = []
-        self.duplicate_items = {}
-        self.num_duplicates  = 0
-
-        for item in self.expected_list:
-            if not item in self.output_list:
-                self.missing_items.append(item)
-            else:
-                # Item found in the output, but it may have been there more than once
-                count = self.item_counts[item]
-                if count > 1:
-                    self.duplicate_items[item]  = count              # Record as a duplicate, storing how many times the item appeared in the output
-                    self.num_duplicates        += count - 1          # Tally the ongoing dup count.  Note that one of the instances is not a dup (e.g., first one was 'good')
-        self.num_missing = len(self.missing_items)                   # Handy reference count, could have just done len() everytime
-
-        # Now, check for data that's 'wrong' and shouldn't have been in the output
-        self.invalid_items = {}
-        self.num_invalid   = 0
-        for item in self.output_list:
-            if (not item in self.expected_list) and (not item in self.invalid_items):    # This item is invalid, and hasn't been recorded as such yet
-                count = self.item_counts[item]                       # Get the number of instances of this item
-                self.invalid_items[item] = count                     # Record the item as invalid, storing how many times the item appeared in the output
-                self.num_invalid += count                            # Add to the ongoing, overall, invalid count
-            
+        if numpy is not None:
+            self.count_expected_with_numpy()
+        else:
+            missing_items   = self.missing_items   = []
+            duplicate_items = self.duplicate_items = {}
+            self.num_duplicates  = 0
+            expected_counts      = self.expected_counts
+            for item in self.expected_list:
+                count = expected_counts[item]
+                if count == 0:
+                    missing_items.append(item)
+                elif count > 1:
+                    duplicate_items[item]  = count                   # Record as a duplicate, storing how many times the item appeared in the output
+                    self.num_duplicates   += count - 1               # Tally the ongoing dup count.  Note that one of the instances is not a dup (e.g., first one was 'good')
+        self.num_missing = len(self._missing_items)                  # Handy reference count, could have just done len() everytime
+
+        # Now, the data that's 'wrong' and shouldn't have been in the output, with how many times each item appeared
+        self.num_invalid = sum(self._invalid_items.values())        # The overall invalid count
+
+
+    # NumPy version of the missing/duplicate half, vectorized over the counting array without copying it
+    def count_expected_with_numpy(self):
+        counts     = numpy.frombuffer(self.expected_counts, dtype=numpy.uintc)     # counts[item], counts[0] unused
+        duplicates = numpy.flatnonzero(counts > 1)
+        self.missing_items   = (numpy.flatnonzero(counts[1:] == 0) + 1).tolist()
+        self.duplicate_items = dict(zip(duplicates.tolist(), counts[duplicates].tolist()))
+        self.num_duplicates  = int((counts[duplicates].astype(numpy.int64) - 1).sum())
+
 
     # Driver function to make printing out the details easier to follow and update
     def print_details(self, print_section_start):
@@ -398,9 +700,41 @@ class run_results_object():
 
 
 
+# Convenience class to hold how long a run took, so engines can be compared on the same config.
+# CPU times come from os.times(), so they cover every thread in the process (harness threads included) plus any joined child processes.
+class run_timing:
+    __slots__ = ("engine", "wall", "user", "sys", "gcs", "locks", "slots")
+
+    def __init__(self, engine, wall, user, sys, gcs=0):
+        self.engine = engine                             # Name of the engine that ran the producer/consumer functions
+        self.wall   = wall                               # Wall clock seconds from starting the first thread to joining the last one
+        self.user   = user                               # User CPU seconds used during that window
+        self.sys    = sys                                # System CPU seconds used during that window
+        self.gcs    = gcs                                # Garbage collector passes during that window (in this process)
+        self.locks  = None                               # lockstats.profile_object for the run, when profiled with -P
+        self.slots  = None                               # [(seconds, capacity), ...] for an adaptive buffer (-e adaptive)
+
+    def items_per_sec(self, items):
+        try:              return items / self.wall
+        except Exception: return 0
+
+    # The adaptive capacity trajectory, 'slots @ seconds' per change.  Long ones keep the first and last few changes.
+    def slots_str(self, head=8, tail=4):
+        steps = ["%d @%.3fs" % (slots, at) for at, slots in self.slots]
+        if len(steps) > head + tail: steps = steps[:head] + ["... %d more ..." % (len(steps) - head - tail)] + steps[-tail:]
+        capacities = [slots for at, slots in self.slots]
+        return "%s   (min=%d max=%d final=%d, %d changes)" % (" -> ".join(steps), min(capacities), max(capacities), capacities[-1], len(self.slots) - 1)
+
+    def as_str(self, items):
+        return "engine=%-10s wall=%8.4fs   cpu user=%8.4fs sys=%8.4fs   items/sec=%12.1f   gc=%d" % (self.engine, self.wall, self.user, self.sys, self.items_per_sec(items), self.gcs)
+
+
+
 # Convenience class to help build a single running count, base, and percent
 # Will also be used to accumulate corresponding stat across runs
 class a_stat:
+    __slots__ = ("runs", "count", "base", "percent")
+
     def __init__(self, count=0, base=0):
         if base: self.runs = 1                           # A Stat is either associated with a given run, or a collection of runs.  This is triggered off 'base' during init.  
         else:    self.runs = 0                           # If base was zero, this is going to be a collection of runs.
@@ -419,6 +753,8 @@ class a_stat:
 # Convenience class to help maintain and print a set of stats about a run, each statistic primarily being a_stat class instance
 # Will also be used to accumulate corresponding info across runs
 class run_stats:
+    __slots__ = ("missing", "duplicates", "invalid", "ooo", "idle_producers", "idle_consumers", "killed", "clean_runs", "ooo_not_zero")
+
     def __init__(self, set_clean=False, num_missing=0, num_duplicates=0, num_invalid=0, num_expected=0, ooo_order=0, output_items=0, killed=False, producers=0, idle_producers=0, consumers=0, idle_consumers=0):
         self.missing          = a_stat(num_missing,             num_expected)       # Stats on the number of missing      items   (this init works with base = anything, even zero)
         self.duplicates       = a_stat(num_duplicates,          num_expected)       # Stats on the number of duplicate    items   (this init works with base = anything, even zero)
@@ -615,6 +951,7 @@ class run_stats:
 
 def print_summaries_and_grade(a_list, grade):
     overall_stats = run_stats()                          # Create overall stats
+    latencies     = []                                   # (config, queueing latencies) for configs that have runs recorded with -L
     num = len(a_list)                                    # if there's just one config passed in, will limit prints to avoid printing info that's already been output during the processing that just took place.
 
     if num > 1:                                          # Have multiple configs to process, need to put out summary header
@@ -629,20 +966,88 @@ def print_summaries_and_grade(a_list, grade):
             print("\n")                                  # Separate the config one-liners
 
         overall_stats.add(config.total_stats)            # Add this config info to overall stats
+        if config.queueing() is not None: latencies.append((config, config.queueing()))
 
     if num > 1:                                          # Have multiple configs to process, need to put out overall header and overall details
         print("\n\n\n\nv-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v        Overall Results        v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v-v\n")
         print("%s" % overall_stats.main_data_as_str(ooo_msg=ooo_target_error))  
 
+        if latencies:                                    # Queueing latency per config, then across all of them
+            print("\n%s" % label("Queue latency"))
+            for config, queueing in latencies:
+                print("    %-40s %s" % (config.name_and_key, latency.as_str(queueing)))
+            print("    %-40s %s" % ("ALL", latency.as_str([ns for config, queueing in latencies for ns in queueing])))
+
     overall_stats.print_sample_score()                   # Output the overall grade
 
 
 
+# Columns written by write_bench_csv, one row per run
+BENCH_FIELDS = ["python", "engine", "batch", "config", "key", "producers", "consumers", "slots", "items", "run",
+                "wall", "user", "sys", "items_per_sec", "gc", "ooo_percent", "missing", "duplicates", "invalid", "killed"]
+
+# Append one CSV row per timed run of each config to filename, writing the header first if the file is new.
+# Appending lets sweeps with different engines (-e) or Python versions build up one baseline file.
+def write_bench_csv(filename, a_list, batch=1):
+    try:
+        new_file = not os.path.exists(filename) or os.path.getsize(filename) == 0
+        f_csv    = open(filename, 'a', newline='')
+    except Exception as err:
+        print("\nERROR: Can't write benchmark file '%s'\n" % filename, file=sys.stderr)
+        print("Actual system error message: ", err, file=sys.stderr)
+        sys.exit(1)
+
+    writer = csv.writer(f_csv)
+    if new_file: writer.writerow(BENCH_FIELDS)
+    rows = 0
+    for config in a_list:
+        for run in config.runs:
+            timing = getattr(run, "timing", None)
+            if not timing: continue                              # Only runs executed this time have timing (not Control-C'd or re-analyzed ones)
+            writer.writerow([platform.python_version(), timing.engine, batch, config.name, config.key,
+                             config.producers, config.consumers, config.slots, config.items, run.run_num,
+                             "%.6f" % timing.wall, "%.6f" % timing.user, "%.6f" % timing.sys, "%.1f" % timing.items_per_sec(run.items), timing.gcs,
+                             "%.2f" % run.percents.ooo.percent, run.num_missing, run.num_duplicates, run.num_invalid, int(bool(run.percents.killed.count))])
+            rows += 1
+    f_csv.close()
+    print("\n%s %d rows appended to '%s'" % (label("Benchmark"), rows, filename))
+
+
    
 # Each line should have this format, with data separated by whitespace:
 # Name   Producers   Consumers   Slots   Items   Timeout(in seconds)
 #
 # Grade-Sample01    3   1    7    57   1
+#
+# Producers, Consumers, Slots and Items can also be a grid of values, and the line turns into one config per combination:
+#
+# Sweep             1-4  1,2  2-64*2  1000  5        <- p=1,2,3,4  c=1,2  s=2,4,8,16,32,64  (4 x 2 x 6 = 48 configs)
+
+# Turn one grid value into a list of ints.  Comma separated parts, each one of:
+#   n           just n
+#   lo-hi       lo, lo+1, ... hi
+#   lo-hi:step  lo, lo+step, ... up to hi
+#   lo-hi*mult  lo, lo*mult, lo*mult*mult, ... up to hi
+def grid_values(text):
+    values = []
+    for part in text.split(','):
+        m = re.fullmatch(r'(\d+)(?:-(\d+)(?:([:*])(\d+))?)?', part)
+        if not m: raise ValueError("bad grid value '%s'" % part)
+        lo, hi, how, by = m.groups()
+        lo = int(lo)
+        if hi is None:
+            values.append(lo)
+            continue
+        hi = int(hi)
+        by = int(by) if by else 1
+        if hi < lo or (how == ':' and by < 1) or (how == '*' and (by < 2 or lo < 1)):
+            raise ValueError("bad grid range '%s'" % part)
+        while lo <= hi:
+            values.append(lo)
+            if how == '*': lo *= by
+            else:          lo += by
+    return values
+
 
 def read_configs_from_file(grade_file):
     try:
@@ -652,8 +1057,9 @@ def read_configs_from_file(grade_file):
         print("Actual system error message: ", err, file=sys.stderr)
         sys.exit(1)
 
-    configs = []                                                # set configs to empty
-    i       = 0                                                 # Want to count put out error messages by line number
+    configs   = []                                              # set configs to empty
+    key_lines = {}                                              # key -> line number that made its config, to report grid overlaps
+    i         = 0                                               # Want to count put out error messages by line number
     for line in g_file.readlines():                             # Read each line from the file
         i += 1                                                  # Increment line number
         if line.startswith('#'):                                # Ignore comment lines
@@ -670,18 +1076,26 @@ def read_configs_from_file(grade_file):
         # Have 6 parts, but they not be 'good'
         name  = parts[0]                                        # Name will get checked as valid as part of config_object creation
         try:                                                    # Assume any 'int' is good, though really, should be doing some 'logical' check on them.
-            producers = int(parts[1])                           # Maybe I'll add that to the config_object init at some point...
-            consumers = int(parts[2])                     
-            slots     = int(parts[3])                     
-            items     = int(parts[4]) 
+            producers = grid_values(parts[1])                   # Maybe I'll add that to the config_object init at some point...
+            consumers = grid_values(parts[2])                   # Each of these is a list, usually of one value (see grid_values)
+            slots     = grid_values(parts[3])                     
+            items     = grid_values(parts[4]) 
             timeout   = int(parts[5])
         except Exception as err:   
             print("\nERROR: Bad data in GRADE file.  See line %d: '%s'" % (i, line.strip()))
-            print("       Make sure these are all integers: Producer='%s', Consumer='%s', Slots='%s', Items='%s', and Timeout='%s'.\n" % (parts[1], parts[2], parts[3], parts[4], parts[5]))
+            print("       Make sure these are all integers (or grids like 1-4, 1,2 or 2-64*2): Producer='%s', Consumer='%s', Slots='%s', Items='%s', and Timeout='%s'.\n" % (parts[1], parts[2], parts[3], parts[4], parts[5]))
             print("Actual system error message: ", err, file=sys.stderr)
             sys.exit(1)
 
-        # Use input line as parms to config_object, adding returned object to list of configs
-        configs.append(analyze.config_object(name, producers, consumers, slots, items, timeout))  
+        # Use input line as parms to config_object, adding returned object to list of configs.  One per grid combination.
+        # Grids on different lines can land on the same key.  The first line to reach a key keeps it, later ones are skipped.
+        for p, c, s, n in itertools.product(producers, consumers, slots, items):
+            key = config_key(p, c, s, n)
+            if key in configs_by_key:
+                first = ("line %d" % key_lines[key]) if key in key_lines else "an earlier config"
+                print("WARNING: config '%s' on line %d is already run by %s, skipping it here: '%s'" % (key, i, first, line.strip()), file=sys.stderr)
+                continue
+            key_lines[key] = i
+            configs.append(analyze.config_object(name, p, c, s, n, timeout))  
             
     return configs  
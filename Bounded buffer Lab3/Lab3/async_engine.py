@@ -0,0 +1,187 @@
+import sys
+import asyncio
+import threading
+import time
+import analyze
+import runner
+import latency
+
+
+# Same names as blocking_locks_object, but asyncio primitives, so the coroutines below read like the blocking engine.
+# Created inside the running event loop by execute_async_run.
+class async_locks_object:
+    def __init__(self):
+        self.producer_file_in   = asyncio.Lock()          # producer lock for INPUT_FILE  access
+        self.consumer_file_out  = asyncio.Lock()          # consumer lock for OUTPUT_FILE access
+
+        self.producer_buffer    = asyncio.Lock()          # producer lock for buffer access
+        self.consumer_buffer    = asyncio.Lock()          # consumer lock for buffer access
+
+        self.not_full           = asyncio.Condition(self.producer_buffer)   # producers wait here when the buffer is full
+        self.not_empty          = asyncio.Condition(self.consumer_buffer)   # consumers wait here when the buffer is empty
+        self.waiting            = 0                       # consumers queued on not_empty, woken or not, written under consumer_buffer
+        self.loop               = asyncio.get_running_loop()
+        self.loop_thread        = threading.get_ident()   # The thread running the loop, to tell loop-side calls from timer-thread calls
+
+    async def wake(self):
+        async with self.not_full:  self.not_full.notify_all()
+        async with self.not_empty: self.not_empty.notify_all()
+
+    # Called by runner.kill_buffer from the timer thread.  That's a different OS thread, so hand the wake-up to the loop.
+    # This is the cooperative cancellation: every sleeping coroutine wakes, sees buffer.KILL and returns.
+    def wake_all(self):
+        if threading.get_ident() == self.loop_thread: self.loop.create_task(self.wake())
+        elif not self.loop.is_closed():
+            try:              self.loop.call_soon_threadsafe(self.loop.create_task, self.wake())
+            except Exception: pass                        # Loop closed between the check and the call, nobody left to wake
+
+
+
+# =======================================================================================================
+# Coroutine producer.  Same steps as blocking_producer.  A coroutine only gives up the loop at an 'await',
+# so each pass ends with 'await asyncio.sleep(0)' to let the other producers and consumers have a turn.
+
+async def async_producer(producer_num, f_in, buffer, locks):
+    while not buffer.KILL:
+        async with locks.producer_file_in:                                   # Lock the file input
+            line = f_in.readline()                                           # Read a line of data from f_in
+            try:              item = int(line)                               # Turn the read input line into an integer 'item'
+            except Exception: item = 0                                       # Past the end of file (or bad data), mark as invalid
+
+        if item == 0:                                                        # No more input, this producer is done
+            return
+
+        async with locks.not_full:                                           # Lock the buffer
+            while ((buffer.IN + 1) % buffer.NUM_SLOTS) == buffer.OUT and not buffer.KILL:
+                await locks.not_full.wait()                                  # Buffer full, sleep until a consumer frees a slot (or KILL)
+            if buffer.KILL:
+                return
+            buffer.ITEM[buffer.IN]     = item                                # Insert the 2 parts into their columns (no tuple)
+            buffer.PRODUCER[buffer.IN] = producer_num
+            buffer.IN = (buffer.IN + 1) % buffer.NUM_SLOTS                   # Advance IN
+
+        async with locks.not_empty:                                          # Tell one sleeping consumer there is data
+            locks.not_empty.notify()
+        await asyncio.sleep(0)                                               # Let the other coroutines run
+
+
+
+# =======================================================================================================
+# Coroutine consumer.  Same steps as blocking_consumer, but items are handed out first come, first served.
+# A consumer back from 'await asyncio.sleep(0)' would otherwise take the next item before the consumers asleep in
+# not_empty.wait() got their turn, and with more consumers than producers most of them would never get one.  So a
+# consumer that finds others queued (locks.waiting) queues behind them, asyncio's Condition wakes them in order, and
+# a consumer that leaves items behind wakes the next one in line.
+
+async def async_consumer(consumer_num, f_out, buffer, locks):
+    write_record = getattr(f_out, "write_record", None)                     # Binary output (-F bin) takes the 3 numbers as is
+    while not buffer.KILL:
+        async with locks.not_empty:                                          # Lock the buffer
+            if (locks.waiting or buffer.IN == buffer.OUT) and not buffer.PRODUCERS_DONE and not buffer.KILL:
+                locks.waiting += 1                                           # Get in line
+                try:
+                    await locks.not_empty.wait()                             # Sleep until it's our turn (or done/KILL)
+                    while buffer.IN == buffer.OUT and not buffer.PRODUCERS_DONE and not buffer.KILL:
+                        await locks.not_empty.wait()                         # Buffer empty, sleep until a producer adds data (or done/KILL)
+                finally:
+                    locks.waiting -= 1
+            if buffer.IN == buffer.OUT or buffer.KILL:                       # Still empty, so producers are done (or KILL set), stop consuming
+                return
+            item         = buffer.ITEM[buffer.OUT]                           # Pull the 2 parts out of their columns (no tuple)
+            producer_num = buffer.PRODUCER[buffer.OUT]
+            buffer.OUT = (buffer.OUT + 1) % buffer.NUM_SLOTS                 # Advance OUT
+            if buffer.IN != buffer.OUT and locks.waiting:
+                locks.not_empty.notify()                                     # Items left over, wake the next consumer in line
+
+        async with locks.not_full:                                           # Tell one sleeping producer there is a free slot
+            locks.not_full.notify()
+
+        async with locks.consumer_file_out:                                  # Lock f_out
+            if write_record: write_record(item, producer_num, consumer_num)  # Write a 3-part 'tuple' to f_out
+            else:            f_out.write('%d\t%d\t%d\n' % (item, producer_num, consumer_num))
+        await asyncio.sleep(0)                                               # Let the other coroutines run
+
+
+
+# Create one task per coroutine, same print as runner.start_threads so the run output looks the same
+def start_tasks(kind, count, target, f, a_buffer, locks, tasks):
+    print("%s Starting %d %ss using '%s' ..." % (analyze.label("Threads"), count, kind.lower(), target.__name__))
+    for x in range(count):
+        tasks.append(asyncio.create_task(target(x+1, f, a_buffer, locks), name="%s-%d" % (kind, x+1)))
+
+
+# The event loop side of a run.  Mirrors the thread start/join order in runner.execute_run.
+async def run_tasks(config, run, engine, p_target, c_target, f_in, f_out, holder, options):
+    aBuffer = holder["buffer"]
+    locks   = holder["locks"] = async_locks_object()
+
+    producer_tasks = []
+    consumer_tasks = []
+    if run % 2:                                                # On Odd numbered runs, start producer first
+        start_tasks("Producer", config.producers, p_target, f_in,  aBuffer, locks, producer_tasks)
+        start_tasks("Consumer", config.consumers, c_target, f_out, aBuffer, locks, consumer_tasks)
+    else:                                                      # On Even numbered runs, start consumer first
+        start_tasks("Consumer", config.consumers, c_target, f_out, aBuffer, locks, consumer_tasks)
+        start_tasks("Producer", config.producers, p_target, f_in,  aBuffer, locks, producer_tasks)
+
+    watchdog = runner.watchdog_object(config.timeout, options.stall, options.grace, f_out, aBuffer, locks)
+    watchdog.start(producer_tasks + consumer_tasks)            # Same watchdog as the thread engines.  Its kill_buffer call wakes the coroutines via wake_all.
+
+    stuck = await wait_bounded(producer_tasks, watchdog)       # Wait for every producer coroutine, up to the deadline
+    aBuffer.PRODUCERS_DONE = True                              # Let consumer coroutines know the producers are done
+    await locks.wake()
+    print("%s Producers done." % analyze.label("Threads"))
+
+    stuck += await wait_bounded(consumer_tasks, watchdog)      # Wait for every consumer coroutine, up to the deadline
+    aBuffer.CONSUMERS_DONE = True                              # Let the watchdog know the consumers are done
+    watchdog.finish()
+    runner.abandon(stuck)                                      # Tasks have a cancel(), so abandoning also cancels them
+    print("%s Consumers done." % analyze.label("Threads"))
+
+
+
+# asyncio version of runner.join_bounded
+async def wait_bounded(tasks, watchdog):
+    pending = set(tasks)
+    while pending:
+        remaining = watchdog.deadline() - time.monotonic()
+        if remaining <= 0: break
+        done, pending = await asyncio.wait(pending, timeout=min(remaining, runner.WATCHDOG_POLL))
+    return [t for t in tasks if t in pending]
+
+
+
+# engine_object.execute_run for the asyncio engine.  Every producer and consumer is a coroutine on one event loop
+# in this thread, so -p 500 -c 500 costs 1000 tasks instead of 1000 OS threads.
+def execute_async_run(config, run, engine, p_target, c_target, input_file, output_file, options):
+    if not asyncio.iscoroutinefunction(p_target) or not asyncio.iscoroutinefunction(c_target):
+        print("\nERROR: Engine '%s' needs coroutine ('async def') producer and consumer functions.  Got '%s' and '%s'.\n" % (engine.name, p_target.__name__, c_target.__name__), file=sys.stderr)
+        sys.exit(1)
+
+    holder  = {"buffer": engine.make_buffer(config.slots)}    # The locks are built inside the loop, holder lets us see them from here
+    aBuffer = holder["buffer"]
+    aBuffer.BATCH = options.batch
+    timing  = None
+    f_in    = engine.open_input(input_file)                    # Open   READ  input  file handle
+    f_out   = engine.open_output(output_file)                  # Create WRITE output file handle
+    recorder = latency.recorder_object() if options.latency else None
+    if recorder: f_in = latency.instrument(aBuffer, f_in, recorder)    # Stamp items as they are read, inserted and removed
+
+    try:
+        start  = runner.start_timing()
+        asyncio.run(run_tasks(config, run, engine, p_target, c_target, f_in, f_out, holder, options))
+        timing = runner.stop_timing(engine, start)
+        if aBuffer.KILL:
+            f_out.write('%d\t%d\t%d\n' % (-1, -1, -1))         # Writes 3-part 'tuple' to OUTPUT_FILE to show KILL happened
+
+    except KeyboardInterrupt:                                  # asyncio.run already cancelled every task on the way out
+        print("\n\nControl-C from terminal captured by buffer.py.  All producer/consumer tasks were cancelled.")
+        runner.kill_buffer(aBuffer, f_out)                     # Sets buffer.KILL and notes that in f_out
+        print("\nCalling analyze after user interrupt.\n\n")
+
+    f_out.close()
+    f_in.close()
+    if recorder: latency.write_latency_file(output_file, recorder)
+    killed = aBuffer.KILL
+    aBuffer.release()
+    return killed, timing
@@ -0,0 +1,189 @@
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import analyze
+import engines
+import records
+import runner
+
+
+# Microbenchmarks for pieces of the lab that are hard to see in a full threaded run.
+#
+#   python3 bench.py storage        Buffer slot storage: the list of (item, producer_num) tuples the student engine keeps
+#                                   (tuple_buffer_object) vs buffer_object's int64 columns, thru the ITEMS tuple view and
+#                                   direct (engine code).
+#   python3 bench.py parse          Text output parsing: the line by line parser (text mode, records.text_row per line)
+#                                   vs the mmap block tokenizer (records.text_blocks), alone and inside a full analysis.
+#                                   Without NumPy only the line by line cases run.
+#
+# Everything runs in one thread with no locks, so the numbers are the cost of the storage (or parsing) itself.
+
+DEFAULT_ITEMS  = 1000000            # Default number of items pushed thru the buffer
+DEFAULT_SLOTS  = "10,1000,100000"   # Default buffer sizes to try
+DEFAULT_LINES  = "1000000,10000000,50000000"     # Default output file sizes (lines) to parse
+DEFAULT_ROUNDS = {"storage": 3, "parse": 1}      # Default number of timed rounds per case (the best one is reported)
+PARSE_BLOCK    = 1000000            # Lines generated per write when building a parse test file
+
+
+# The original buffer_object.ITEMS layout, still the student engine's (engines.tuple_buffer_object), one tuple per insert
+def storage_tuples(slots, items):
+    buffer = [0] * slots
+    lag    = slots // 2                                   # Consumer reads half a buffer behind the producer, so slots hold live data
+    for i in range(items):
+        buffer[i % slots] = (i + 1, 1)
+        if i >= lag: (item, producer_num) = buffer[(i - lag) % slots]
+    return buffer
+
+
+# buffer_object thru its tuple compatibility view (LINE P-3 and LINE C-1 of student.py, if it ran over buffer_object)
+def storage_view(slots, items):
+    buffer = engines.buffer_object(slots)
+    lag    = slots // 2
+    for i in range(items):
+        buffer.ITEMS[i % slots] = (i + 1, 1)
+        if i >= lag: (item, producer_num) = buffer.ITEMS[(i - lag) % slots]
+    return buffer
+
+
+# buffer_object thru the ITEM/PRODUCER columns (what the engines in engines.py do)
+def storage_columns(slots, items):
+    buffer = engines.buffer_object(slots)
+    lag    = slots // 2
+    for i in range(items):
+        buffer.ITEM[i % slots]     = i + 1
+        buffer.PRODUCER[i % slots] = 1
+        if i >= lag:
+            item         = buffer.ITEM[(i - lag) % slots]
+            producer_num = buffer.PRODUCER[(i - lag) % slots]
+    return buffer
+
+
+STORAGE_CASES = [("tuples", storage_tuples), ("view", storage_view), ("columns", storage_columns)]
+
+
+# Bytes held by a filled buffer, counting the tuples and ints hanging off a list but not the small shared ints
+def storage_bytes(buffer):
+    if isinstance(buffer, list):
+        return sys.getsizeof(buffer) + sum([sys.getsizeof(slot) + sys.getsizeof(slot[0]) for slot in buffer if isinstance(slot, tuple)])
+    return sys.getsizeof(buffer) + sys.getsizeof(buffer.ITEM) + sys.getsizeof(buffer.PRODUCER)
+
+
+def bench_storage(args):
+    for slots in [int(s) for s in args.slots.split(",")]:
+        print("\n%s slots=%d items=%d rounds=%d" % (analyze.label("Storage"), slots, args.items, args.rounds))
+        for name, fn in STORAGE_CASES:
+            best = None
+            for r in range(args.rounds):
+                gcs    = runner.gc_collections()
+                start  = time.perf_counter()
+                buffer = fn(slots, args.items)
+                wall   = time.perf_counter() - start
+                gcs    = runner.gc_collections() - gcs
+                if best is None or wall < best[0]: best = (wall, gcs)
+            wall, gcs = best
+            print("    %-8s wall=%8.4fs   items/sec=%12.1f   gc=%5d   bytes=%10d" % (name, wall, args.items / wall, gcs, storage_bytes(buffer)))
+
+
+# A text output file of 'lines' records from 4 producers and 4 consumers, in order except for 1 in 8 items swapped
+# with the next one.  Built a block at a time with NumPy, so the 50M line file doesn't take minutes (parse_file_rows
+# does the same without NumPy, much slower).
+def parse_file(directory, lines):
+    filename = os.path.join(directory, "Bench_p4_c4_s16_i%d_r1.txt" % lines)
+    if records.numpy is None: return parse_file_rows(filename, lines)
+    rng      = records.numpy.random.default_rng(1)
+    with open(filename, 'w') as f:
+        for start in range(1, lines+1, PARSE_BLOCK):
+            items = records.numpy.arange(start, min(start + PARSE_BLOCK, lines + 1))
+            swap  = 2 * records.numpy.flatnonzero(rng.random(len(items) // 2) < 0.25)     # Even positions only, so swaps don't overlap
+            swap  = swap[swap + 1 < len(items)]
+            items[swap], items[swap + 1] = items[swap + 1], items[swap]
+            prods = rng.integers(1, 5, len(items))
+            conss = rng.integers(1, 5, len(items))
+            f.write("".join(["%d\t%d\t%d\n" % row for row in zip(items.tolist(), prods.tolist(), conss.tolist())]))
+    return filename
+
+def parse_file_rows(filename, lines):
+    rng = random.Random(1)
+    with open(filename, 'w') as f:
+        for start in range(1, lines+1, PARSE_BLOCK):
+            items = list(range(start, min(start + PARSE_BLOCK, lines + 1)))
+            for i in range(0, len(items) - 1, 2):
+                if rng.random() < 0.25: items[i], items[i + 1] = items[i + 1], items[i]
+            f.write("".join(["%d\t%d\t%d\n" % (item, rng.randint(1, 4), rng.randint(1, 4)) for item in items]))
+    return filename
+
+
+# The line by line parser run_results_object used before the block reader: text mode, one text_row per line
+def parse_lines(filename):
+    rows = 0
+    with open(filename, 'r') as f:
+        for line in f:
+            records.text_row(line)
+            rows += 1
+    return rows
+
+
+def parse_mmap(filename):
+    return sum([len(items) for items, prods, conss in records.text_blocks(filename)])
+
+
+# A whole run_results_object analysis, with the per-record loop (analyze without NumPy) or the block reader
+def analyze_lines(filename):
+    saved, analyze.numpy = analyze.numpy, None
+    try:     return analyze.run_results_object(filename, False, False, False, False).items
+    finally: analyze.numpy = saved
+
+def analyze_mmap(filename):
+    return analyze.run_results_object(filename, False, False, False, False).items
+
+
+PARSE_CASES = [("lines", parse_lines), ("mmap", parse_mmap), ("analyze-lines", analyze_lines), ("analyze-mmap", analyze_mmap)]
+
+
+def bench_parse(args):
+    cases = PARSE_CASES
+    if records.numpy is None:                                # The mmap block parser needs NumPy, time what runs without it
+        cases = [(name, fn) for name, fn in PARSE_CASES if "mmap" not in name]
+        print("\n%s NumPy isn't installed, skipping the mmap cases ('pip install numpy' to run them)" % analyze.label("Parse"))
+    directory = tempfile.mkdtemp(prefix="parse-bench-")
+    try:
+        for lines in [int(n) for n in args.lines.split(",")]:
+            start    = time.perf_counter()
+            filename = parse_file(directory, lines)
+            print("\n%s lines=%d bytes=%d rounds=%d   (file built in %.1fs)" % (analyze.label("Parse"), lines, os.path.getsize(filename), args.rounds, time.perf_counter() - start))
+            walls = {}
+            for name, fn in cases:
+                best = None
+                for r in range(args.rounds):
+                    start = time.perf_counter()
+                    rows  = fn(filename)
+                    wall  = time.perf_counter() - start
+                    if best is None or wall < best: best = wall
+                if rows != lines: print("    %-14s parsed %d rows, expected %d" % (name, rows, lines))
+                walls[name] = best
+                base = walls.get(name.replace("mmap", "lines"), best)
+                print("    %-14s wall=%8.4fs   lines/sec=%12.1f   speedup=%5.1fx" % (name, best, lines / best, base / best))
+            os.remove(filename)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+
+parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter, description="Microbenchmarks for the bounded buffer lab")
+parser.add_argument("bench",                choices=["storage", "parse"],                                 help="Which microbenchmark to run")
+parser.add_argument("-i", "--items",        type=int,   default=DEFAULT_ITEMS,   metavar = "#",   help="Number of items per case                           [ Default: %d" % DEFAULT_ITEMS)
+parser.add_argument("-s", "--slots",        type=str,   default=DEFAULT_SLOTS,   metavar = "s",   help="Comma separated buffer sizes                       [ Default: '%s'" % DEFAULT_SLOTS)
+parser.add_argument("-l", "--lines",        type=str,   default=DEFAULT_LINES,   metavar = "s",   help="Comma separated output file sizes in lines (parse) [ Default: '%s'" % DEFAULT_LINES)
+parser.add_argument("-r", "--rounds",       type=int,   default=None,            metavar = "#",   help="Timed rounds per case, best one is reported        [ Default: %s" % ", ".join(["%d (%s)" % (DEFAULT_ROUNDS[b], b) for b in DEFAULT_ROUNDS]))
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.rounds is None: args.rounds = DEFAULT_ROUNDS[args.bench]
+    if args.items < 1 or args.rounds < 1:
+        print("\nERROR: Items and rounds must be positive integers.\n", file=sys.stderr)
+        sys.exit(1)
+    {"storage": bench_storage, "parse": bench_parse}[args.bench](args)
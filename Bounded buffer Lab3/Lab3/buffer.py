@@ -10,6 +10,14 @@ import time
 import glob
 import secrets
 import multiprocessing
+import engines
+import runner
+import latency
+import lockstats
+import tuner
+import records
+import cache
+import follow
 
 try:
     analyze.TARGET_OOO = min(40, 4.5 * multiprocessing.cpu_count())  # Cap this at 40%, but try to factor in the VCPU
@@ -18,26 +26,9 @@ except Exception:
 
 orig_target = analyze.TARGET_OOO
 
-# Convenience class for buffer related info, so it can be passed into functions all at once
-class buffer_object:
-    def __init__(self, slots):
-        self.IN               = 0                         # Initialize IN and OUT to zero (e.g., they are equal, so the buffer is initially empty)
-        self.OUT              = 0                         # Initialize IN and OUT to zero (e.g., they are equal, so the buffer is initially empty)
-        self.KILL             = False                     # Variable to pass in user keyboard interrupts to help terminate the producer/consumer loops.  
-        self.PRODUCERS_DONE   = False                     # Denotes producer THREADS are done.  This is set by the wrapper code.  Student code should NOT set this, but it should CHECK it in the consumer function to break out of the 'while' loop.
-        self.CONSUMERS_DONE   = False                     # Denotes consumer THREADS are done.  This is set by the wrapper code.  Student code should NOT set or use this.  The wrapper code uses it to check timeouts and set buffer.KILL
-        self.NUM_SLOTS        = slots                     # Prescribed logical size of buffer
-        self.ITEMS            = [0] * slots               # Initialize the data item array to the right size
-
-
-# Convenience class for locks, so they can be passed into functions all at once
-class locks_object:
-    def __init__(self):
-        self.producer_file_in   = threading.Lock()        # producer lock for INPUT_FILE  access
-        self.consumer_file_out  = threading.Lock()        # consumer lock for OUTPUT_FILE access
-
-        self.producer_buffer    = threading.Lock()        # producer lock for buffer access
-        self.consumer_buffer    = threading.Lock()        # consumer lock for buffer access
+# buffer_object and locks_object live in engines.py so the alternate engines can build on them.
+# Imported here so existing references to buffer.buffer_object / buffer.locks_object keep working.
+from engines import buffer_object, locks_object
 
 
 
@@ -49,6 +40,10 @@ DEFAULT_BUFFER_SLOTS = 10           # Default size of buffer
 DEFAULT_INPUT_LINES  = 100          # Default length of file INPUT_FILE to create
 DEFAULT_RUNS         = 1            # Default number of runs per config
 DEFAULT_TIMEOUT      = 2            # Default number of seconds to let a test run before trying to kill
+DEFAULT_STALL        = 0            # Default seconds without progress before the watchdog kills a run.  0 turns stall detection off.
+DEFAULT_GRACE        = 1            # Default seconds threads get to stop after KILL before the run stops waiting on them
+DEFAULT_BATCH        = 1            # Default batch size.  1 means one item per lock hold, like the student code
+DEFAULT_JOBS         = 1            # Default number of worker processes.  1 runs every (config, run) in this process, one after another
 DEFAULT_GLOB         = "output/*"   # As a default, analyze all the files in the output directory if called for analysis only
 DEFAULT_CONFIG_NAME  = "CMD-LINE"   # Set default config name to show that it came from the command line, instead of the GRADE array.  User can override.
 DEFAULT_GRADE_FILE   = "sample_grade_configs.txt"   # File with sample grade configs for testing
@@ -67,14 +62,36 @@ parser.add_argument("-s", "--slots",        type=int,   default=DEFAULT_BUFFER_S
 parser.add_argument("-i", "--items",        type=int,   default=DEFAULT_INPUT_LINES,   metavar = "#",   help="Number of items initially placed in input.txt      [ Default:   %3d" % DEFAULT_INPUT_LINES)
 parser.add_argument("-r", "--runs",         type=int,   default=DEFAULT_RUNS,          metavar = "#",   help="Number of times to run each configuration          [ Default:   %3d" % DEFAULT_RUNS)
 parser.add_argument("-t", "--timeout",      type=float, default=DEFAULT_TIMEOUT,       metavar = "#",   help="Number of seconds before buffer.KILL is set        [ Default:   %3d" % DEFAULT_TIMEOUT)
+parser.add_argument("-S", "--stall",        type=float, default=DEFAULT_STALL,         metavar = "#",   help="Kill a run early after # seconds with no progress   [ Default:   %3d  (0 = only use -t)" % DEFAULT_STALL)
+parser.add_argument("-w", "--grace",        type=float, default=DEFAULT_GRACE,         metavar = "#",   help="Seconds after KILL before stuck threads are dropped [ Default:   %3d" % DEFAULT_GRACE)
 parser.add_argument("-n", "--name",         type=str,   default=DEFAULT_CONFIG_NAME,   metavar = "s",   help="Name for config being run from command line        [ Default: '%s'"  % DEFAULT_CONFIG_NAME)
 parser.add_argument("-o", "--outOfOrder",   type=int,   default=analyze.TARGET_OOO,    metavar = "#",   help="Target Out of Order percent                        [ Default:   %3d" % analyze.TARGET_OOO)
-parser.add_argument("-m", "--matplot",                  action="store_true",                            help="Show matplotlib graph                              [ Default: False\n\n ")
+parser.add_argument("-m", "--matplot",                  action="store_true",                            help="Show matplotlib graph                              [ Default: False")
+parser.add_argument("-j", "--jobs",         type=int,   default=DEFAULT_JOBS,          metavar = "#",   help="Number of worker processes for runs/-A (1 = serial) [ Default:   %3d" % DEFAULT_JOBS)
+parser.add_argument("-b", "--batch",        type=int,   default=DEFAULT_BATCH,         metavar = "#",   help="Items per lock hold in batch mode (1 = no batching) [ Default:   %3d" % DEFAULT_BATCH)
+parser.add_argument("-K", "--shards",       type=int,   default=0,                     metavar = "#",   help="Rings for -e sharded (0 = min of -p and -c)         [ Default:   %3d" % 0)
+parser.add_argument("-D", "--adapt",        type=str,   default="2-4096",              metavar = "s",   help="Slot range 'min-max' -e adaptive resizes within     [ Default: '2-4096'")
+parser.add_argument("-F", "--format",       type=str,   default="text",                metavar = "s",   help="Run output format, 'text' or 'bin' (packed records) [ Default: 'text'",
+                                                        choices=list(records.FORMATS))
+parser.add_argument("-W", "--writer",                   action="store_true",                            help="One writer thread writes f_out, consumers hand off  [ Default: False")
+parser.add_argument("-R", "--reuse",                    action="store_true",                            help="Reuse one pool of worker threads across all runs    [ Default: False")
+parser.add_argument("-L", "--latency",                  action="store_true",                            help="Record per-item queueing latency to latency/ files  [ Default: False")
+parser.add_argument("-P", "--profile",                  action="store_true",                            help="Profile lock acquisitions and wait/hold times      [ Default: False")
+parser.add_argument("-k", "--lockfile",     type=str,   default=None,                  metavar = "s",   help="Append the lock profile to CSV file 's' (sets -P)   [ Default: None")
+parser.add_argument("-T", "--tune",         type=str,   default=None,                  metavar = "s",   help="Auto-tune -s/-c for -p/-i, goal 's' is %-20s [ Default: None\n%s" % ("'" + "' or '".join(tuner.GOALS) + "'", "\n".join(["%-10s %s" % (g, tuner.GOALS[g]) for g in tuner.GOALS])),
+                                                        choices=list(tuner.GOALS))
+parser.add_argument("-B", "--bench",        type=str,   default=None,                  metavar = "s",   help="Append per-run timing/OOO rows to CSV file 's'      [ Default: None  (Use with -G for a grid sweep)\n"
+                                                                                                  "p1_c1 configs on -e spsc/auto also run on 'blocking', to compare")
+parser.add_argument("-e", "--engine",       type=str,   default=engines.DEFAULT_ENGINE, metavar = "s",  help="Producer/consumer engine to run                    [ Default: '%s'\n%s\n\n " % (engines.DEFAULT_ENGINE, engines.engines_help()),
+                                                        choices=list(engines.ENGINES))
 
 parser.add_argument("-g", "--grade",                    action="store_true",                            help="Shorthand for -G '%s'        [ Default: False" % DEFAULT_GRADE_FILE)
 parser.add_argument("-G", "--GradeFile",    type=str,   default=None,                  metavar = "s",   help="Run 'GRADE' configurations found in filename 's'   [ Default: None\n\n ")
 
 parser.add_argument("-a", "--analyze",                  action="store_true",                            help="Shorthand for -A 'output/*'                        [ Default: False")
+parser.add_argument("-f", "--follow",       type=str,   default=None,                  metavar = "s",   help="Follow run output file 's' live, like 'tail -f'     [ Default: None  (Stops at KILL, or EOF once the run is over)")
+parser.add_argument("-N", "--no-cache",                 action="store_true",                            help="Re-analyze every file, don't use the analysis cache [ Default: False")
+parser.add_argument("-H", "--hash",                     action="store_true",                            help="Match cached analysis on content hash, not mtime   [ Default: False")
 parser.add_argument("-A", "--AnalyzeFile",  type=str,   default=None,                  metavar = "s",   help=ANALYZE_HELP)
 
 parser.add_argument("-l", "--list",                     action="store_true",                            help="List available teacher functions                   [ Requires access to teacher.py")
@@ -91,20 +108,56 @@ if args.outOfOrder <= 0 or args.outOfOrder > 100:
     sys.exit(1)
 analyze.TARGET_OOO = args.outOfOrder
 
+if args.jobs < 1:
+    print("\nERROR: Parameter -j (--jobs) value must be at least 1.  Input was %d.\n" % args.jobs, file=sys.stderr)
+    sys.exit(1)
+
+if args.stall < 0 or args.grace < 0:
+    print("\nERROR: Parameters -S (--stall) and -w (--grace) can't be negative.  Input was %s and %s.\n" % (args.stall, args.grace), file=sys.stderr)
+    sys.exit(1)
+
+try:
+    adapt = tuple([int(part) for part in args.adapt.split("-")])   # (min, max) slots for -e adaptive
+    if len(adapt) != 2 or not 2 <= adapt[0] <= adapt[1]: raise ValueError()
+except ValueError:
+    print("\nERROR: Parameter -D (--adapt) value must be 'min-max' with 2 <= min <= max.  Input was '%s'.\n" % args.adapt, file=sys.stderr)
+    sys.exit(1)
+
+if args.batch < 1:
+    print("\nERROR: Parameter -b (--batch) value must be at least 1.  Input was %d.\n" % args.batch, file=sys.stderr)
+    sys.exit(1)
+
+
+# If -f set, just follow that run's output file as it's written (see follow.py), then exit
+if args.follow:
+    follow.follow(args.follow, args.timeout + args.grace)
+    print("\nProgram Use Terminated -- Follow Only.  (Run in directory '%s')\n" % pathlib.Path.cwd().name)
+    sys.exit()
+
 
 # If -a or -A flag set, just do analysis on specified previous run output, then exit
 if args.analyze or args.AnalyzeFile:
     if args.AnalyzeFile: input_glob = args.AnalyzeFile                        # if -A parm set, use it for input glob
     else:                input_glob = DEFAULT_GLOB                            # otherwise, use default glob as a convenience
+    cache.configure(not args.no_cache, args.hash)                             # Unchanged files analyzed before come from '<dir>/.analysis_cache'
 
-    for filename in sorted(glob.glob(input_glob)):
+    filenames = sorted(glob.glob(input_glob))
+    for filename in filenames:
         config = analyze.config_from_filename(filename, args.timeout)         # Find the config that should manage this run, based on the filename
         config.queue_run(filename, False, args.matplot, True, True)           # Queue the run in that config for analyzing once we have all the filenames assigned to configs
 
-    for key in sorted(analyze.configs_by_key):
-        analyze.configs_by_key[key].add_queued()                              # Tell each config to process and print the queued runs.
+    if args.jobs > 1:                                                         # Analyze the runs across worker processes, printed in the same order
+        analyze.add_queued_in_pool([analyze.configs_by_key[key] for key in sorted(analyze.configs_by_key)], args.jobs)
+    else:
+        for key in sorted(analyze.configs_by_key):
+            analyze.configs_by_key[key].add_queued()                          # Tell each config to process and print the queued runs.
     analyze.print_summaries_and_grade(analyze.configs_by_key, args.grade)     # Reprint the summaries (if needed, since there could have been a ton of info fly by when analyzing a bunch of files) and the grade
 
+    if not args.no_cache and filenames:
+        hits = sum([run.cached for config in analyze.configs_by_key.values() for run in config.runs])
+        left = cache.evict([cache.cache_dir(filename) for filename in filenames])
+        print("\n%s %d of %d runs from cache, %d analyzed   (%.1f MB cached)" % (analyze.label("Analysis cache"), hits, len(filenames), len(filenames) - hits, left / 2**20))
+
     print("\n\nUsed Target OOO = %5.2f%%.  %60s" % (analyze.TARGET_OOO, "" if orig_target != args.outOfOrder else "(You can override this target via the -o parameter.)"))
     print("Program Use Terminated -- Analysis Only.  (Run in directory '%s')\n" % pathlib.Path.cwd().name)
     sys.exit()
@@ -121,8 +174,17 @@ else: # -g or -G flag set, find file and use as Grade configurations
     configs = analyze.read_configs_from_file(grade_file) 
 
 
-p_target = student.student_producer   # set default producer function
-c_target = student.student_consumer   # set default consumer function
+engine    = engines.ENGINES[args.engine]  # engine picked via -e (default is the student code)
+teacher_p = None                          # teacher producer function, if -x/-z set
+teacher_c = None                          # teacher consumer function, if -y/-z set
+
+if args.batch > 1 and not engine.batch_producer and not engine.resolve:
+    print("\nERROR: Engine '%s' has no batch mode.  Use -b 1, or an engine that supports it (%s).\n" % (engine.name, ", ".join([e.name for e in engines.ENGINES.values() if e.batch_producer])), file=sys.stderr)
+    sys.exit(1)
+
+if args.lockfile:         args.profile = True
+if args.tune == "p99":    args.latency = True            # Can't score p99 without the latency side files
+options = runner.run_options_object(batch=args.batch, stall=args.stall, grace=args.grace, latency=args.latency, profile=args.profile, writer=args.writer, reuse=args.reuse, shards=args.shards, adapt=adapt)
 
 # Manage override of producer/consumer function
 if args.list or args.tproducer or args.tconsumer or args.tboth:
@@ -142,31 +204,62 @@ if args.list or args.tproducer or args.tconsumer or args.tboth:
         args.tproducer = args.tboth
         args.tconsumer = args.tboth
 
-    if args.tproducer: p_target = teacher.which_teacher_producer(args.tproducer)    # register appropriate function, if set
-    if args.tconsumer: c_target = teacher.which_teacher_consumer(args.tconsumer)    # register appropriate function, if set
+    if args.tproducer: teacher_p = teacher.which_teacher_producer(args.tproducer)   # register appropriate function, if set
+    if args.tconsumer: teacher_c = teacher.which_teacher_consumer(args.tconsumer)   # register appropriate function, if set
 
 
+# The engine and producer/consumer functions for one config.  Engines like 'auto' pick a different engine per config,
+# batch mode swaps in the batching functions, and teacher functions override whatever the engine would have used.
+def targets_for(config):
+    if engine.resolve: run_engine = engine.resolve(config, options)
+    else:              run_engine = engine
 
-# Sets KILL to True in buffer, and writes 3-part 'tuple' to OUTPUT_FILE to show KILL happened
-def kill_buffer(a_buffer, f_out):
-    a_buffer.KILL = True
-    try:
-        f_out.write('%d\t%d\t%d\n' % (-1, -1, -1))                          
-        f_out.flush()  
-    except Exception as err:
-        print("\nERROR: Failed to cleanly write KILL tuple to file.  Grade for this run may be inflated.\n", file=sys.stderr)
-        print("Actual system error message: ", err, file=sys.stderr)
+    if args.batch > 1 and not run_engine.batch_producer:
+        print("\nERROR: Engine '%s' has no batch mode.  Use -b 1.\n" % run_engine.name, file=sys.stderr)
+        sys.exit(1)
+
+    if args.batch > 1: p_target, c_target = run_engine.batch_producer, run_engine.batch_consumer
+    else:              p_target, c_target = run_engine.producer,       run_engine.consumer
+
+    if teacher_p: p_target = teacher_p
+    if teacher_c: c_target = teacher_c
+
+    if run_engine.spsc and (config.producers != 1 or config.consumers != 1):
+        print("\nERROR: Engine '%s' only works with one producer and one consumer, config '%s' has %d and %d.  Try -e auto.\n" % (run_engine.name, config.name, config.producers, config.consumers), file=sys.stderr)
+        sys.exit(1)
 
+    if args.latency and run_engine.worker is not threading.Thread:
+        print("\nERROR: Engine '%s' runs producers/consumers as processes, so -L (--latency) can't collect their timestamps.  Use a thread or asyncio engine.\n" % run_engine.name, file=sys.stderr)
+        sys.exit(1)
 
+    if args.profile and (run_engine.worker is not threading.Thread or run_engine.execute_run):
+        print("\nERROR: Engine '%s' doesn't use thread locks from locks_object, so there is nothing for -P (--profile) to measure.\n" % run_engine.name, file=sys.stderr)
+        sys.exit(1)
+
+    if args.writer and (run_engine.worker is not threading.Thread or run_engine.execute_run):
+        print("\nERROR: Engine '%s' doesn't run consumers as threads in this process, so -W (--writer) can't hand records to a writer thread.\n" % run_engine.name, file=sys.stderr)
+        sys.exit(1)
+
+    if args.reuse and (run_engine.worker is not threading.Thread or run_engine.execute_run):
+        print("\nERROR: Engine '%s' doesn't start its producers/consumers as threads from the runner, so there is nothing for -R (--reuse) to pool.\n" % run_engine.name, file=sys.stderr)
+        sys.exit(1)
+
+    if args.jobs > 1 and run_engine.worker is not threading.Thread:
+        print("\nERROR: Engine '%s' runs producers/consumers as processes, which can't be started from -j (--jobs) worker processes.  Use -j 1.\n" % run_engine.name, file=sys.stderr)
+        sys.exit(1)
+    return run_engine, p_target, c_target
+
+
+# Every engine a config is run on.  With -B, a p1_c1 config that got the lock-free SPSC ring (-e spsc, or -e auto) is
+# also run the same number of times on the lock-based blocking engine, as runs -r+1 thru 2*-r, so the config's
+# Throughput lines (and the CSV's engine column) compare the two on the same input.
+def engines_for(config):
+    targets = [targets_for(config)]
+    if args.bench and targets[0][0].spsc and not (teacher_p or teacher_c):
+        locked = engines.ENGINES["blocking"]
+        targets.append((locked, locked.producer, locked.consumer))
+    return targets
 
-# Timer function to try to kill off threads that are looping too long
-def timer_thread(seconds, f_out, a_buffer, locks):
-    time.sleep(seconds)
-    if not a_buffer.PRODUCERS_DONE or not a_buffer.CONSUMERS_DONE:
-        # Only set KILL if there are producer or consumer threads still running
-        print("%s %s" % (analyze.label("Timer"), "Expired.  Setting buffer.KILL=True to stop threads and marking run as killed.  If threads don't gracefully stop, enter Control-C to forcefully stop them."))
-        kill_buffer(a_buffer, f_out)
-    
 
 
 overall_test_num = 1                                          # Variable to keep track of the overall number of tests run during this program invocation
@@ -178,104 +271,67 @@ if not os.path.exists(INPUT_DIR):  os.makedirs(INPUT_DIR)     # Create the input
 if not os.path.exists(OUTPUT_DIR): os.makedirs(OUTPUT_DIR)    # Create the output directory, if not present
 
 
+# -T: search slots/consumers instead of running the configs, then exit
+if args.tune:
+    INPUT_FILE, how = runner.prepare_input_file(INPUT_DIR, args.items)
+    best = tuner.tune(args.tune, args.producers, args.consumers, args.slots, args.items, args.timeout, args.runs, INPUT_FILE, targets_for, options, records.FORMATS[args.format])
+    print("Program Use Terminated -- Auto-tune.  (Run in directory '%s')\n" % pathlib.Path.cwd().name)
+    sys.exit(0 if best else 1)
+
+
 # Loop over each configuration, running each 
+setup_time = 0                                                # Seconds spent building/checking input files, reported apart from the runs
+run_start  = time.perf_counter()
+tasks       = []                                              # With --jobs, runs are collected here and handed to a process pool after the loop
+input_lines = {}                                              # Config key -> its 'Input:' line, printed before its runs
 for config in configs:
 
-    INPUT_FILE = config.filename(INPUT_DIR)                   # Get appropriate input filename for config
-    f          = open(INPUT_FILE, 'w')                        # Create the input file
-    for i in range(1, config.items+1):                        # For requested size...
-        f.write("%d\n" % i)                                   #    put out each 'item'
-    f.close()                                                 # Close the created input file.
-
-    for run in range(1, args.runs+1):                         # Execute this configuration the requested number of times
-        aBuffer = buffer_object(config.slots)                 # Create a new buffer for each run, to avoid bad spill-over info
-        locks   = locks_object()                              # Create new locks for each run, to avoid spill-over
-
-        config.print_run_header(overall_test_num, run)        # Print the header, so the 'running' messages appear as part of the analysis
-        overall_test_num += 1                                 # Increment overall test count, which is different than runs since multiple configs could be executed
-        OUTPUT_FILE = config.filename(OUTPUT_DIR, run)        # Get appropriate output file for config
-
-        try:
-            producer_threads   = []                           # list to help manage producer threads for this run
-            consumer_threads   = []                           # list to help manage consumer threads for this run
-
-            f_in  = open(INPUT_FILE,  'r')                    # Open   READ  input  file handle
-            f_out = open(OUTPUT_FILE, 'w')                    # Create WRITE output file handle
-        
-            if run % 2:                                       # On Odd numbered runs, start producer first
-                print("%s Starting %d producers using '%s' ..." % (analyze.label("Threads"), config.producers, p_target.__name__))
-                for x in range(config.producers):             # Create producer threads, have them run the 'producer' function
-                    thread = threading.Thread(target=p_target, args=(x+1,f_in,aBuffer,locks), name="Producer-%d" % (x+1))           # Setup thread, function, args, and name
-                    producer_threads.append(thread)           # Add new thread to producer_threads list                                              
-                    thread.start()                            # Start the new producer thread
-                
-                print("%s Starting %d consumers using '%s' ..." % (analyze.label("Threads"), config.consumers, c_target.__name__))
-                for x in range(config.consumers):             # Create consumer threads, have them run the 'consumer' function
-                    thread = threading.Thread(target=c_target, args=(x+1,f_out,aBuffer,locks), name="Consumer-%d" % (x+1))          # Setup thread, function, args, and name
-                    consumer_threads.append(thread)           # Add new thread to consumer_threads list                                
-                    thread.start()                            # Start the new consumer thread
-            
-            else:                                             # On Even numbered runs, start consumer first
-                print("%s Starting %d consumers using '%s' ..." % (analyze.label("Threads"), config.consumers, c_target.__name__))
-                for x in range(config.consumers):             # Create consumer threads, have them run the 'consumer' function
-                    thread = threading.Thread(target=c_target, args=(x+1,f_out,aBuffer,locks), name="Consumer-%d" % (x+1))          # Setup thread, function, args, and name
-                    consumer_threads.append(thread)           # Add new thread to consumer_threads list                                
-                    thread.start()                            # Start the new consumer thread
-
-                print("%s Starting %d producers using '%s' ..." % (analyze.label("Threads"), config.producers, p_target.__name__))
-                for x in range(config.producers):             # Create producer threads, have them run the 'producer' function
-                    thread = threading.Thread(target=p_target, args=(x+1,f_in,aBuffer,locks), name="Producer-%d" % (x+1))           # Setup thread, function, args, and name
-                    producer_threads.append(thread)           # Add new thread to producer_threads list                                              
-                    thread.start()                            # Start the new producer thread
-                
-
-
-
-            thread = threading.Thread(target=timer_thread, args=(config.timeout,f_out,aBuffer,locks), name="Timer", daemon=True) # Setup timer thread, function, args, and name
-            thread.start()                                    # Start the new timer    thread
-
-            for p in producer_threads: p.join()               # Wait for each individual producer threads
-            aBuffer.PRODUCERS_DONE = True                     # Let consumer threads know the producer threads are done
-            print("%s Producers done." % analyze.label("Threads"))
-
-            for c in consumer_threads: c.join()               # Wait for each individual consumer threads
-            aBuffer.CONSUMERS_DONE = True                     # Let timer thread know the consumer threads are done
-            print("%s Consumers done." % analyze.label("Threads"))
-
-            if aBuffer.KILL:
-                f_out.write('%d\t%d\t%d\n' % (-1, -1, -1))    # Writes 3-part 'tuple' to OUTPUT_FILE to show KILL happened       
-            f_out.close()                                     # Close the raw output file
-        
-
-        except KeyboardInterrupt:
-            print("\n\nControl-C from terminal captured by buffer.py.  Setting 'aBuffer.KILL = True'")
-            print("so the main loops in the producer and consumer functions see this and gracefully terminate.")
-            print("If your code is stuck in a tight inner infinite loop, you'll probably have to press")
-            print("Control-C again multiple times to kill everything more forcefully.\n\n")
-            
-            print("If the program doesn't gracefully stop, you can try to get an analysis of this run by entering:\n")
-            print("    python3 buffer.py -A %s\n\n" % OUTPUT_FILE)
-
-            kill_buffer(aBuffer, f_out)                       # Sets buffer.KILL and notes that in f_out 
-
-            for p in producer_threads: p.join()               # Wait for each individual producer thread
-            aBuffer.PRODUCERS_DONE = True                     # Let consumer threads know the producer threads are done
-            print("Producer threads stopped.")
-
-            for c in consumer_threads: c.join()               # Wait for each individual consumer thread
-            aBuffer.CONSUMERS_DONE = True                     # Let timer thread know the consumer threads are done
-            print("Consumer threads stopped.")
-            f_out.close()                                     # Close the raw output file
-
-            print("\nCalling analyze after user interrupt.")
-            print("If you think you broke out of an infinite loop, there may be a lot of data to analyze.")
-            print("If you don't want to wait on that analysis, enter Control-C again.\n\n")
-            
-        # adds the current run to the config, and prints the 'live' stats on it
-        this_run = config.add_run(OUTPUT_FILE, aBuffer.KILL, args.matplot, print_details=True, print_section_start=False) 
-    config.print_all_run_results()                            # Per config, print out the summary results of each run, and a combined view
+    setup_start     = time.perf_counter()
+    INPUT_FILE, how = runner.prepare_input_file(INPUT_DIR, config.items)    # Input only depends on the item count, so it is shared and reused when possible
+    setup_time     += time.perf_counter() - setup_start
+    input_lines[config.key] = "\n%s %s (%s)" % (analyze.label("Input"), INPUT_FILE, how)
+    if args.jobs <= 1: print(input_lines[config.key])        # With --jobs, printed when the config's first run is replayed
+
+    for number, (run_engine, p_target, c_target) in enumerate(engines_for(config)):
+        for run in range(number*args.runs + 1, (number+1)*args.runs + 1):    # Execute this configuration the requested number of times (per engine)
+            OUTPUT_FILE = config.filename(OUTPUT_DIR, run, records.FORMATS[args.format])   # Get appropriate output file for config (.txt or .bin)
+
+            if args.jobs > 1:                                 # Parallel: just remember the run, the pool executes it below
+                tasks.append(runner.run_task_object(config, run, overall_test_num, run_engine, p_target, c_target, INPUT_FILE, OUTPUT_FILE, options, analyze.TARGET_OOO, args.matplot))
+                overall_test_num += 1
+                continue
+
+            config.print_run_header(overall_test_num, run)    # Print the header, so the 'running' messages appear as part of the analysis
+            overall_test_num += 1                             # Increment overall test count, which is different than runs since multiple configs could be executed
+
+            killed, timing = runner.execute_run(config, run, run_engine, p_target, c_target, INPUT_FILE, OUTPUT_FILE, options)
+
+            # adds the current run to the config, and prints the 'live' stats on it
+            this_run = config.add_run(OUTPUT_FILE, killed, args.matplot, print_details=True, print_section_start=False, timing=timing,
+                                      latency_file=latency.latency_filename(OUTPUT_FILE) if args.latency else None)
+    if args.jobs <= 1:
+        config.print_all_run_results()                        # Per config, print out the summary results of each run, and a combined view
+
+if tasks:                                                     # Each (config, run) in its own worker process, output and stats merged back in order
+    runner.run_tasks_in_pool(tasks, args.jobs, args.matplot, lambda config: config.print_all_run_results(),
+                             lambda config: print(input_lines[config.key]))
+
+run_time = time.perf_counter() - run_start - setup_time
+
 analyze.print_summaries_and_grade(configs, args.grade)        # Print out an overall view of all configs, all runs and grade
 
+if args.bench:
+    analyze.write_bench_csv(args.bench, configs, args.batch)  # One CSV row per run: wall/CPU time, items/sec, OOO, ...
+
+if args.lockfile:                                             # One CSV row per config, lock and thread
+    rows = lockstats.write_profile_csv(args.lockfile, configs)
+    print("\n%s %d rows appended to '%s'" % (analyze.label("Lock profile"), rows, args.lockfile))
+
+if runner.worker_pool:                                        # -R, serial runs (with -j each worker process has its own pool)
+    print("\n%s %s" % (analyze.label("Worker pool"), runner.worker_pool.summary()))
+
+print("\n\n%s %.4fs    %s %.4fs" % (analyze.label("Setup time"), setup_time, analyze.label("Run time"), run_time))
+
 print("\n\nUsed Target OOO = %5.2f%%.  %s" % (analyze.TARGET_OOO, "" if orig_target != args.outOfOrder else "(You can override this target via the -o parameter.)"))
 print("Program Use Terminated.    (Run in directory '%s')\n" % pathlib.Path.cwd().name)
 sys.exit()
\ No newline at end of file
@@ -0,0 +1,116 @@
+import os
+import json
+import hashlib
+
+
+# Persistent analysis cache for -a/-A.
+#
+# Each analyzed output file gets one entry file in a CACHE_DIR next to it (output/.analysis_cache for the default
+# glob), named after a hash of the file's absolute path.  An entry holds the file's identity when it was analyzed
+# (size and mtime, plus a sha256 of the contents with -H) and run_results_object.cache_fields(): the counters, idle
+# counts and the missing/duplicate/invalid lists.  A file whose identity still matches is served from its entry
+# instead of being read again, anything new or changed is analyzed and its entry rewritten.
+#
+# Entries are JSON, plain numbers and lists only.  The cache sits in the output directory, which may be shared or
+# handed in for grading, and reading an entry someone else wrote there must never be able to run code.
+#
+# Runs that will be graphed (-m) are never served or stored, the plot data isn't kept.  Entries are written to a temp
+# file and renamed into place, so -j workers can share a cache.  evict() keeps each cache under MAX_BYTES, dropping
+# the entries used longest ago first (a hit touches its entry).
+
+CACHE_DIR     = ".analysis_cache"
+CACHE_VERSION = 3                        # Bump when run_results_object.cache_fields changes, older entries are then just misses
+ENTRY_EXT     = ".json"
+MAX_BYTES     = 64 * 1024 * 1024         # Per cache directory, enforced by evict()
+HASH_BLOCK    = 1 << 20
+
+ENABLED       = True                     # -N turns the cache off
+HASH          = False                    # -H keys entries on the contents' sha256 instead of the mtime
+
+
+# Settings to hand to a worker process, which may not inherit this module's globals (e.g., 'spawn' start method)
+def settings():
+    return ENABLED, HASH
+
+def configure(enabled, use_hash):
+    global ENABLED, HASH
+    ENABLED, HASH = enabled, use_hash
+
+
+def cache_dir(outfile):
+    return os.path.join(os.path.dirname(outfile), CACHE_DIR)
+
+
+def file_digest(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# The cache entry for one output file.  The file is stat'ed when the entry is made, before it's analyzed, so a file
+# that changes while it's being read is stored under its old identity and simply misses next time.
+class entry_object:
+    def __init__(self, outfile, killed):
+        self.path     = os.path.abspath(outfile)
+        self.killed   = killed
+        self.filename = os.path.join(cache_dir(outfile), hashlib.sha1(self.path.encode()).hexdigest() + ENTRY_EXT)
+        try:            stat = os.stat(outfile)
+        except OSError: stat = None
+        self.size     = stat.st_size     if stat else None
+        self.mtime_ns = stat.st_mtime_ns if stat else None
+        self.digest   = None
+
+    # A list, as it comes back from JSON
+    def key(self):
+        if HASH and self.digest is None: self.digest = file_digest(self.path)
+        return [CACHE_VERSION, self.path, self.size, None if HASH else self.mtime_ns, self.digest, self.killed]
+
+    # The cached run_results_object.cache_fields() dict, or None on a miss
+    def load(self):
+        if not ENABLED or self.size is None: return None
+        try:
+            with open(self.filename, 'r') as f:
+                entry = json.load(f)
+            key, fields = entry["key"], entry["fields"]
+        except Exception:                    # No entry, a torn one, or one that isn't what store() writes
+            return None
+        if key != self.key() or not isinstance(fields, dict): return None
+        try:            os.utime(self.filename)           # Most recently used, for evict()
+        except OSError: pass
+        return fields
+
+    def store(self, fields):
+        if not ENABLED or self.size is None: return
+        temp = "%s.%d.tmp" % (self.filename, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            with open(temp, 'w') as f:
+                json.dump({"key": self.key(), "fields": fields}, f, separators=(",", ":"))
+            os.replace(temp, self.filename)
+        except OSError:                      # e.g., a read-only archive directory.  Not caching is never an error.
+            try:            os.remove(temp)
+            except OSError: pass
+
+
+# Drop the least recently used entries of each cache directory until it's under max_bytes.  Returns the bytes left.
+def evict(directories, max_bytes=MAX_BYTES):
+    left = 0
+    for directory in sorted(set(directories)):
+        try:            names = os.listdir(directory)
+        except OSError: continue
+        entries = []
+        for name in names:
+            try:            stat = os.stat(os.path.join(directory, name))
+            except OSError: continue                      # Evicted by someone else in the meantime
+            entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+        total = sum([size for mtime, size, name in entries])
+        for mtime, size, name in entries:
+            if total <= max_bytes: break
+            try:            os.remove(os.path.join(directory, name))
+            except OSError: continue
+            total -= size
+        left += total
+    return left
@@ -0,0 +1,636 @@
+import time
+import array
+import functools
+import threading
+import multiprocessing
+import student
+import shm_engine
+import async_engine
+import records
+
+
+# Tuple-style view over the two item/producer columns, so student code can keep doing 'buffer.ITEMS[i] = (item, producer_num)'
+# and '(item, producer_num) = buffer.ITEMS[i]'.  The engines below skip it and use buffer.ITEM / buffer.PRODUCER directly.
+class items_view:
+    __slots__ = ("buffer",)
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def __len__(self):
+        return self.buffer.NUM_SLOTS
+
+    def __getitem__(self, index):
+        return (self.buffer.ITEM[index], self.buffer.PRODUCER[index])
+
+    def __setitem__(self, index, value):
+        self.buffer.ITEM[index], self.buffer.PRODUCER[index] = value
+
+
+# Convenience class for buffer related info, so it can be passed into functions all at once.
+# The slots are two preallocated int64 columns instead of a list of (item, producer_num) tuples, so moving an item
+# thru the buffer doesn't allocate a tuple per insert (and the GC has nothing to chase).  ITEMS is the old tuple interface.
+class buffer_object:
+    __slots__ = ("IN", "OUT", "KILL", "PRODUCERS_DONE", "CONSUMERS_DONE", "NUM_SLOTS", "ITEM", "PRODUCER", "ITEMS", "BATCH")
+
+    def __init__(self, slots):
+        self.IN               = 0                         # Initialize IN and OUT to zero (e.g., they are equal, so the buffer is initially empty)
+        self.OUT              = 0                         # Initialize IN and OUT to zero (e.g., they are equal, so the buffer is initially empty)
+        self.KILL             = False                     # Variable to pass in user keyboard interrupts to help terminate the producer/consumer loops.
+        self.PRODUCERS_DONE   = False                     # Denotes producer THREADS are done.  This is set by the wrapper code.  Student code should NOT set this, but it should CHECK it in the consumer function to break out of the 'while' loop.
+        self.CONSUMERS_DONE   = False                     # Denotes consumer THREADS are done.  This is set by the wrapper code.  Student code should NOT set or use this.  The wrapper code uses it to check timeouts and set buffer.KILL
+        self.NUM_SLOTS        = slots                     # Prescribed logical size of buffer
+        self.ITEM             = array.array('q', bytes(8 * slots))   # Item column, one int64 per slot
+        self.PRODUCER         = array.array('q', bytes(8 * slots))   # Producer number column, one int64 per slot
+        self.ITEMS            = items_view(self)          # (item, producer_num) tuple view over the two columns
+        self.BATCH            = 1                         # Items per lock hold.  Set by the wrapper code from -b, only the batch functions look at it.
+
+    # The wrapper code calls this once every thread has been joined.  Nothing to give back for plain arrays.
+    def release(self):
+        pass
+
+
+# The student engine's buffer: ITEMS is the original list of (item, producer_num) tuples, no columns (ITEM/PRODUCER are None).
+# Student code writes a slot as one tuple store, so even unlocked code can only ever read back a pair that was written
+# together, which the lab relies on.  Thru items_view a slot write is two stores, and a racing read can pair one
+# insert's item with another's producer.  Plain tuples are also faster here (see 'python3 bench.py storage').
+class tuple_buffer_object(buffer_object):
+    __slots__ = ()
+
+    def __init__(self, slots):
+        super().__init__(0)                               # No columns
+        self.NUM_SLOTS        = slots
+        self.ITEM             = None
+        self.PRODUCER         = None
+        self.ITEMS            = [(0, 0)] * slots          # One (item, producer_num) tuple per slot
+
+
+# A plain lock, or a lockstats.profiled_lock when the run is being profiled (-P)
+def new_lock(name, profile=None):
+    if profile: return profile.lock(name)
+    else:       return threading.Lock()
+
+
+# Convenience class for locks, so they can be passed into functions all at once
+class locks_object:
+    def __init__(self, profile=None):
+        self.producer_file_in   = new_lock("producer_file_in",  profile)    # producer lock for INPUT_FILE  access
+        self.consumer_file_out  = new_lock("consumer_file_out", profile)    # consumer lock for OUTPUT_FILE access
+
+        self.producer_buffer    = new_lock("producer_buffer",   profile)    # producer lock for buffer access
+        self.consumer_buffer    = new_lock("consumer_buffer",   profile)    # consumer lock for buffer access
+
+    # The wrapper code calls this after setting buffer.KILL or buffer.PRODUCERS_DONE.
+    # Spinning code re-checks those flags on its own, so there is nobody to wake up here.
+    def wake_all(self):
+        pass
+
+
+
+# Same four locks, plus 'not full' and 'not empty' conditions built on the two buffer locks.
+# Producers sleep on not_full while holding producer_buffer, consumers sleep on not_empty while holding consumer_buffer,
+# so a thread waiting on the buffer gives up both the lock and the CPU instead of spinning with the lock held.
+class blocking_locks_object(locks_object):
+    def __init__(self, profile=None):
+        super().__init__(profile)
+        self.not_full           = threading.Condition(self.producer_buffer)    # producers wait here when the buffer is full
+        self.not_empty          = threading.Condition(self.consumer_buffer)    # consumers wait here when the buffer is empty
+
+    # Wake every waiting thread so it re-checks buffer.KILL and buffer.PRODUCERS_DONE
+    def wake_all(self):
+        with self.not_full:  self.not_full.notify_all()
+        with self.not_empty: self.not_empty.notify_all()
+
+
+
+# =======================================================================================================
+# Blocking producer.  Same contract as student_producer, but waits on locks.not_full instead of spinning.
+# IN is only written under producer_buffer and OUT only under consumer_buffer.  A consumer notifies not_full
+# while holding producer_buffer, so a producer that just saw 'full' is always waiting before the notify lands.
+
+def blocking_producer(producer_num, f_in, buffer, locks):
+    while not buffer.KILL:
+        with locks.producer_file_in:                                         # Lock the file input
+            line = f_in.readline()                                           # Read a line of data from f_in
+            try:              item = int(line)                               # Turn the read input line into an integer 'item'
+            except Exception: item = 0                                       # Past the end of file (or bad data), mark as invalid
+
+        if item == 0:                                                        # No more input, this producer is done
+            return
+
+        with locks.not_full:                                                 # Lock the buffer
+            while ((buffer.IN + 1) % buffer.NUM_SLOTS) == buffer.OUT and not buffer.KILL:
+                locks.not_full.wait()                                        # Buffer full, sleep until a consumer frees a slot (or KILL)
+            if buffer.KILL:
+                return
+            buffer.ITEM[buffer.IN]     = item                                # Insert the 2 parts into their columns (no tuple)
+            buffer.PRODUCER[buffer.IN] = producer_num
+            buffer.IN = (buffer.IN + 1) % buffer.NUM_SLOTS                   # Advance IN
+
+        with locks.not_empty:                                                # Tell one sleeping consumer there is data
+            locks.not_empty.notify()
+
+
+
+# =======================================================================================================
+# Blocking consumer.  Same contract as student_consumer, but waits on locks.not_empty instead of spinning.
+# Wakes on KILL and PRODUCERS_DONE via locks.wake_all(), which the wrapper code calls after setting either flag.
+
+def blocking_consumer(consumer_num, f_out, buffer, locks):
+    write_record = getattr(f_out, "write_record", None)                     # Binary output (-F bin) takes the 3 numbers as is
+    put          = getattr(f_out, "put", None)                              # Writer stage (-W) takes records inside the buffer lock instead
+    while not buffer.KILL:
+        with locks.not_empty:                                                # Lock the buffer
+            while buffer.IN == buffer.OUT and not buffer.PRODUCERS_DONE and not buffer.KILL:
+                locks.not_empty.wait()                                       # Buffer empty, sleep until a producer adds data (or done/KILL)
+            if buffer.IN == buffer.OUT or buffer.KILL:                       # Still empty, so producers are done (or KILL set), stop consuming
+                return
+            item         = buffer.ITEM[buffer.OUT]                           # Pull the 2 parts out of their columns (no tuple)
+            producer_num = buffer.PRODUCER[buffer.OUT]
+            buffer.OUT = (buffer.OUT + 1) % buffer.NUM_SLOTS                 # Advance OUT
+            if put: put((item, producer_num, consumer_num))                  # Hand off in consumption order, no file lock
+
+        with locks.not_full:                                                 # Tell one sleeping producer there is a free slot
+            locks.not_full.notify()
+
+        if put: continue
+        with locks.consumer_file_out:                                        # Lock f_out
+            if write_record: write_record(item, producer_num, consumer_num)  # Write a 3-part 'tuple' to f_out
+            else:            f_out.write('%d\t%d\t%d\n' % (item, producer_num, consumer_num))
+
+
+
+# =======================================================================================================
+# Batch producer.  Like blocking_producer, but claims up to buffer.BATCH input lines under one producer_file_in hold,
+# then inserts them all under one producer_buffer hold (still sleeping on not_full whenever the buffer fills up).
+# Producers still claim interleaved chunks of the input, so the output stays out of order.
+
+def batch_producer(producer_num, f_in, buffer, locks):
+    while not buffer.KILL:
+        items = []
+        with locks.producer_file_in:                                         # Lock the file input once for the whole batch
+            for i in range(buffer.BATCH):
+                try:              items.append(int(f_in.readline()))         # Turn each read input line into an integer 'item'
+                except Exception: break                                      # Past the end of file (or bad data), stop claiming lines
+
+        if not items:                                                        # No more input, this producer is done
+            return
+
+        with locks.not_full:                                                 # Lock the buffer once for the whole batch
+            for item in items:
+                while ((buffer.IN + 1) % buffer.NUM_SLOTS) == buffer.OUT and not buffer.KILL:
+                    with locks.not_empty:                                    # Batch bigger than the free space.  Consumers haven't been told about
+                        locks.not_empty.notify_all()                         # what's already in, so wake them before sleeping or nobody drains it.
+                    locks.not_full.wait()                                    # Buffer full, sleep until a consumer frees a slot (or KILL)
+                if buffer.KILL:
+                    return
+                buffer.ITEM[buffer.IN]     = item                            # Insert the 2 parts into their columns (no tuple)
+                buffer.PRODUCER[buffer.IN] = producer_num
+                buffer.IN = (buffer.IN + 1) % buffer.NUM_SLOTS               # Advance IN
+
+        with locks.not_empty:                                                # Tell sleeping consumers there is data
+            locks.not_empty.notify(len(items))
+
+        if len(items) < buffer.BATCH:                                        # Hit the end of the input part way thru the batch
+            return
+
+
+
+# =======================================================================================================
+# Batch consumer.  Like blocking_consumer, but drains up to buffer.BATCH slots under one consumer_buffer hold
+# and writes the whole batch to f_out with one write call.
+
+def batch_consumer(consumer_num, f_out, buffer, locks):
+    pack_record = getattr(f_out, "pack_record", None)                       # Binary output (-F bin) gets packed records instead of text lines
+    put         = getattr(f_out, "put", None)                               # Writer stage (-W) takes records inside the buffer lock instead
+    while not buffer.KILL:
+        records = []
+        taken   = 0
+        with locks.not_empty:                                                # Lock the buffer once for the whole batch
+            while buffer.IN == buffer.OUT and not buffer.PRODUCERS_DONE and not buffer.KILL:
+                locks.not_empty.wait()                                       # Buffer empty, sleep until a producer adds data (or done/KILL)
+            if buffer.IN == buffer.OUT or buffer.KILL:                       # Still empty, so producers are done (or KILL set), stop consuming
+                return
+            while buffer.IN != buffer.OUT and taken < buffer.BATCH:
+                item         = buffer.ITEM[buffer.OUT]                       # Pull the 2 parts out of their columns (no tuple)
+                producer_num = buffer.PRODUCER[buffer.OUT]
+                buffer.OUT = (buffer.OUT + 1) % buffer.NUM_SLOTS             # Advance OUT
+                taken     += 1
+                if put:           put((item, producer_num, consumer_num))    # Hand off in consumption order, no file lock
+                elif pack_record: records.append(pack_record(item, producer_num, consumer_num))
+                else:             records.append('%d\t%d\t%d\n' % (item, producer_num, consumer_num))
+
+        with locks.not_full:                                                 # Tell sleeping producers there are free slots
+            locks.not_full.notify(taken)
+
+        if put: continue
+        with locks.consumer_file_out:                                        # Lock f_out once, one write for the whole batch
+            f_out.write((b'' if pack_record else '').join(records))
+
+
+
+# Locks for the single-producer/single-consumer ring.  With one producer and one consumer, IN is only ever written by the
+# producer and OUT only by the consumer, so the slot itself needs no mutex and the four locks are never touched.
+# The two Events are only used to sleep when the ring is full/empty, instead of spinning.  A side that wants to sleep clears
+# its Event and re-checks before waiting, so the other side only has to set() it when it sees it cleared.
+class spsc_locks_object(locks_object):
+    def __init__(self, profile=None):
+        super().__init__(profile)
+        self.not_full           = threading.Event()       # set by the consumer after it frees a slot
+        self.not_empty          = threading.Event()       # set by the producer after it fills a slot
+
+    def wake_all(self):
+        self.not_full.set()
+        self.not_empty.set()
+
+
+
+# =======================================================================================================
+# SPSC producer.  Only ever run as the one producer (see resolve_auto).  Fills the slot, then publishes it by advancing IN.
+# To sleep, it clears not_full and re-checks before waiting, so a consumer that frees a slot in between is never missed.
+
+def spsc_producer(producer_num, f_in, buffer, locks):
+    while not buffer.KILL:
+        try:              item = int(f_in.readline())                        # Only one reader, so no producer_file_in lock
+        except Exception: return                                             # Past the end of file (or bad data), this producer is done
+
+        next_in = (buffer.IN + 1) % buffer.NUM_SLOTS
+        while next_in == buffer.OUT and not buffer.KILL:                     # Full
+            locks.not_full.clear()
+            if next_in == buffer.OUT and not buffer.KILL:                    # Still full after clearing, safe to sleep
+                locks.not_full.wait()
+        if buffer.KILL:
+            return
+        buffer.ITEM[buffer.IN]     = item                                    # Fill the slot first...
+        buffer.PRODUCER[buffer.IN] = producer_num
+        buffer.IN = next_in                                                  # ... then publish it
+        if not locks.not_empty.is_set(): locks.not_empty.set()               # Only pay for set() if the consumer cleared it to sleep
+
+
+
+# =======================================================================================================
+# SPSC consumer.  Only ever run as the one consumer.  Reads the slot, then frees it by advancing OUT.
+
+def spsc_consumer(consumer_num, f_out, buffer, locks):
+    write_record = getattr(f_out, "write_record", None)                     # Binary output (-F bin) takes the 3 numbers as is
+    put          = getattr(f_out, "put", None)                              # Writer stage (-W) takes the record instead
+    while not buffer.KILL:
+        while buffer.IN == buffer.OUT and not buffer.PRODUCERS_DONE and not buffer.KILL:    # Empty
+            locks.not_empty.clear()
+            if buffer.IN == buffer.OUT and not buffer.PRODUCERS_DONE and not buffer.KILL:   # Still empty after clearing, safe to sleep
+                locks.not_empty.wait()
+        if buffer.IN == buffer.OUT or buffer.KILL:                           # Still empty, so the producer is done (or KILL set)
+            return
+        item         = buffer.ITEM[buffer.OUT]                               # Read the slot first...
+        producer_num = buffer.PRODUCER[buffer.OUT]
+        buffer.OUT = (buffer.OUT + 1) % buffer.NUM_SLOTS                     # ... then free it
+        if not locks.not_full.is_set(): locks.not_full.set()                 # Only pay for set() if the producer cleared it to sleep
+        if put:            put((item, producer_num, consumer_num))           # Only one consumer, so no consumer_file_out lock
+        elif write_record: write_record(item, producer_num, consumer_num)
+        else:              f_out.write('%d\t%d\t%d\n' % (item, producer_num, consumer_num))
+
+
+
+# Adaptive buffer (-e adaptive): the ring is allocated at MAX_SLOTS, but producers treat it as full at CAPACITY slots
+# (CAPACITY-1 items, same as a fixed ring of that many slots).  Every ADAPT_WINDOW (or CAPACITY) inserts, the producer holding
+# producer_buffer looks at how long each side spent asleep during the window (seconds summed over threads), against
+# WAIT_SHARE of the window's wall time, always staying within MIN_SLOTS..MAX_SLOTS:
+#   producers stalled on a full ring AND consumers on an empty one -> double CAPACITY (bursts, more slack keeps both busy)
+#   producers didn't stall and the ring never got past an eighth full -> halve it (the slots aren't being used; an eighth
+#   rather than a half leaves room so the next window doesn't just grow it right back)
+#   only producers stalled -> keep it.  Consumers are the bottleneck, a bigger ring would just fill up and add latency.
+# Only producers read CAPACITY and they only change it under producer_buffer, so a resize is a single int store under
+# the lock, no items move.  Shrinking below what is already queued just makes producers wait until consumers drain it.
+# Consumers only ever add to EMPTY_WAIT_TIME (under consumer_buffer); the producer takes the window's share as the
+# difference from its last snapshot, EMPTY_SEEN, so neither side resets a counter the other one writes.
+# TRAJECTORY is (seconds since the buffer was built, CAPACITY) for the start and each change.
+ADAPT_WINDOW = 256                       # Fewest inserts between sizing decisions
+WAIT_SHARE   = 0.05                      # Share of a window's wall time asleep that counts as a side having stalled
+
+class adaptive_buffer_object(buffer_object):
+    __slots__ = ("CAPACITY", "MIN_SLOTS", "MAX_SLOTS", "TRAJECTORY", "STARTED", "WINDOW_START",
+                 "INSERTS", "PEAK", "FULL_WAIT_TIME", "EMPTY_WAIT_TIME", "EMPTY_SEEN")
+
+    def __init__(self, slots, min_slots=2, max_slots=4096):
+        super().__init__(max_slots)
+        self.MIN_SLOTS       = min_slots
+        self.MAX_SLOTS       = max_slots
+        self.CAPACITY        = max(min_slots, min(slots, max_slots))    # Start from -s
+        self.STARTED         = time.perf_counter()
+        self.WINDOW_START    = self.STARTED
+        self.TRAJECTORY      = [(0.0, self.CAPACITY)]
+        self.INSERTS         = 0                      # Window counters, reset after every sizing decision
+        self.PEAK            = 0                      # Most items queued at once
+        self.FULL_WAIT_TIME  = 0.0                    # Seconds producers spent sleeping on a full ring
+        self.EMPTY_WAIT_TIME = 0.0                    # Seconds consumers spent sleeping on an empty ring, ever (written under consumer_buffer)
+        self.EMPTY_SEEN      = 0.0                    # EMPTY_WAIT_TIME at the start of the window
+
+    # Called with producer_buffer held, right after an insert
+    def adapt(self, locks):
+        queued = (self.IN - self.OUT) % self.NUM_SLOTS
+        if queued > self.PEAK: self.PEAK = queued
+        self.INSERTS += 1
+        if self.INSERTS < ADAPT_WINDOW or self.INSERTS < self.CAPACITY: return     # A window has to be able to fill the ring
+
+        now          = time.perf_counter()
+        stalled      = WAIT_SHARE * (now - self.WINDOW_START)
+        empty_seen   = self.EMPTY_WAIT_TIME                          # One read, consumers may add to it meanwhile
+        full_stall   = self.FULL_WAIT_TIME > stalled
+        empty_stall  = empty_seen - self.EMPTY_SEEN > stalled
+        capacity     = self.CAPACITY
+        if   full_stall and empty_stall:                             capacity = min(self.MAX_SLOTS, capacity * 2)    # Both sides stalled, more slack would have kept both busy
+        elif not full_stall and (self.PEAK + 1) * 8 <= capacity:     capacity = max(self.MIN_SLOTS, capacity // 2)  # Ring never filled past an eighth
+        if capacity != self.CAPACITY:
+            if capacity > self.CAPACITY: locks.not_full.notify_all()                   # Room for producers already asleep
+            self.CAPACITY = capacity
+            self.TRAJECTORY.append((now - self.STARTED, capacity))
+        self.INSERTS = self.PEAK = 0
+        self.FULL_WAIT_TIME = 0.0
+        self.EMPTY_SEEN     = empty_seen
+        self.WINDOW_START   = now
+
+
+
+# =======================================================================================================
+# Adaptive producer.  blocking_producer, but 'full' means CAPACITY slots (not NUM_SLOTS) and it times its waits.
+
+def adaptive_producer(producer_num, f_in, buffer, locks):
+    while not buffer.KILL:
+        with locks.producer_file_in:                                         # Lock the file input
+            try:              item = int(f_in.readline())
+            except Exception: return                                         # Past the end of file (or bad data), this producer is done
+
+        with locks.not_full:                                                 # Lock the buffer
+            if (buffer.IN - buffer.OUT) % buffer.NUM_SLOTS >= buffer.CAPACITY - 1 and not buffer.KILL:
+                waited = time.perf_counter()
+                while (buffer.IN - buffer.OUT) % buffer.NUM_SLOTS >= buffer.CAPACITY - 1 and not buffer.KILL:
+                    locks.not_full.wait()                                    # Full at the current capacity, sleep until a slot frees up (or KILL)
+                buffer.FULL_WAIT_TIME += time.perf_counter() - waited
+            if buffer.KILL:
+                return
+            buffer.ITEM[buffer.IN]     = item
+            buffer.PRODUCER[buffer.IN] = producer_num
+            buffer.IN = (buffer.IN + 1) % buffer.NUM_SLOTS
+            buffer.adapt(locks)                                              # Sample occupancy, resize every ADAPT_WINDOW inserts
+
+        with locks.not_empty:                                                # Tell one sleeping consumer there is data
+            locks.not_empty.notify()
+
+
+
+# =======================================================================================================
+# Adaptive consumer.  blocking_consumer, plus timing how long it slept on an empty ring.
+
+def adaptive_consumer(consumer_num, f_out, buffer, locks):
+    write_record = getattr(f_out, "write_record", None)                     # Binary output (-F bin) takes the 3 numbers as is
+    put          = getattr(f_out, "put", None)                              # Writer stage (-W) takes records inside the buffer lock instead
+    while not buffer.KILL:
+        with locks.not_empty:                                                # Lock the buffer
+            if buffer.IN == buffer.OUT and not buffer.PRODUCERS_DONE and not buffer.KILL:
+                waited = time.perf_counter()
+                while buffer.IN == buffer.OUT and not buffer.PRODUCERS_DONE and not buffer.KILL:
+                    locks.not_empty.wait()                                   # Buffer empty, sleep until a producer adds data (or done/KILL)
+                buffer.EMPTY_WAIT_TIME += time.perf_counter() - waited
+            if buffer.IN == buffer.OUT or buffer.KILL:                       # Still empty, so producers are done (or KILL set), stop consuming
+                return
+            item         = buffer.ITEM[buffer.OUT]
+            producer_num = buffer.PRODUCER[buffer.OUT]
+            buffer.OUT = (buffer.OUT + 1) % buffer.NUM_SLOTS
+            if put: put((item, producer_num, consumer_num))                  # Hand off in consumption order, no file lock
+
+        with locks.not_full:                                                 # Tell one sleeping producer there is a free slot
+            locks.not_full.notify()
+
+        if put: continue
+        with locks.consumer_file_out:                                        # Lock f_out
+            if write_record: write_record(item, producer_num, consumer_num)
+            else:            f_out.write('%d\t%d\t%d\n' % (item, producer_num, consumer_num))
+
+
+
+# Sharded buffer: NUM_SHARDS independent rings, each a buffer_object with its own IN/OUT and its own producer/consumer
+# locks, so producers only contend with the producers that share their home ring (and consumers likewise).
+# The config's slots are split across the rings so they still hold slots-1 items in all: every ring keeps one slot
+# empty to tell full from empty, so the rings get slots-1+NUM_SHARDS slots between them, not slots.
+# KILL / PRODUCERS_DONE / CONSUMERS_DONE stay on the outer object.
+# IN and OUT are every ring's IN/OUT, which is all the watchdog needs to see progress.
+class sharded_buffer_object:
+    __slots__ = ("SHARDS", "NUM_SHARDS", "KILL", "PRODUCERS_DONE", "CONSUMERS_DONE", "NUM_SLOTS", "BATCH")
+
+    def __init__(self, slots, shards=1):
+        total                = slots - 1 + shards                          # One spare slot per ring, same items as a single ring
+        self.SHARDS          = [buffer_object(total // shards + (1 if s < total % shards else 0)) for s in range(shards)]
+        self.NUM_SHARDS      = shards
+        self.KILL            = False
+        self.PRODUCERS_DONE  = False
+        self.CONSUMERS_DONE  = False
+        self.NUM_SLOTS       = slots
+        self.BATCH           = 1
+
+    @property
+    def IN(self):
+        return tuple([ring.IN for ring in self.SHARDS])
+
+    @property
+    def OUT(self):
+        return tuple([ring.OUT for ring in self.SHARDS])
+
+    def release(self):
+        pass
+
+
+# One ring's locks.  Same lock names as locks_object, with the ring number appended, so -P reports them per ring.
+class shard_locks_object:
+    def __init__(self, shard, profile=None):
+        self.producer_buffer    = new_lock("producer_buffer-%d" % shard, profile)
+        self.consumer_buffer    = new_lock("consumer_buffer-%d" % shard, profile)
+        self.not_full           = threading.Condition(self.producer_buffer)    # producers with this home ring wait here when it is full
+
+
+# The shared file locks, one shard_locks_object per ring in SHARDS, and the one condition idle consumers sleep on.
+# Consumers only sleep once every ring is empty, so any ring's producer may have to wake them: producers notify
+# not_empty after an insert, but only take its lock when 'sleeping' says some consumer is there.
+class sharded_locks_object(locks_object):
+    def __init__(self, profile=None, shards=1):
+        self.producer_file_in   = new_lock("producer_file_in",  profile)
+        self.consumer_file_out  = new_lock("consumer_file_out", profile)
+        self.SHARDS             = [shard_locks_object(s+1, profile) for s in range(shards)]
+        self.not_empty          = threading.Condition(new_lock("not_empty", profile))   # consumers wait here when every ring is empty
+        self.sleeping           = 0                                                      # consumers in (or about to be in) not_empty.wait()
+
+    def wake_all(self):
+        for shard in self.SHARDS:
+            with shard.not_full:  shard.not_full.notify_all()
+        with self.not_empty: self.not_empty.notify_all()
+
+
+# =======================================================================================================
+# Sharded producer.  Like blocking_producer, but always inserts into its home ring, (producer_num-1) % NUM_SHARDS.
+
+def sharded_producer(producer_num, f_in, buffer, locks):
+    home  = (producer_num - 1) % buffer.NUM_SHARDS
+    ring  = buffer.SHARDS[home]
+    shard = locks.SHARDS[home]
+    while not buffer.KILL:
+        with locks.producer_file_in:                                         # Lock the file input (still shared by every producer)
+            try:              item = int(f_in.readline())
+            except Exception: return                                         # Past the end of file (or bad data), this producer is done
+
+        with shard.not_full:                                                 # Lock the home ring only
+            while ((ring.IN + 1) % ring.NUM_SLOTS) == ring.OUT and not buffer.KILL:
+                shard.not_full.wait()                                        # Home ring full, sleep until a consumer frees a slot (or KILL)
+            if buffer.KILL:
+                return
+            ring.ITEM[ring.IN]     = item
+            ring.PRODUCER[ring.IN] = producer_num
+            ring.IN = (ring.IN + 1) % ring.NUM_SLOTS
+
+        if locks.sleeping:                                                   # Read after the insert, see sharded_consumer
+            with locks.not_empty:                                            # Tell one idle consumer there is data
+                locks.not_empty.notify()
+
+
+# Take one item out of ring 'index' if it has one.  Returns (item, producer_num), or None if the ring is empty.
+# With the writer stage (-W), the record is handed off inside the ring's lock, like blocking_consumer does.
+def take_from_shard(index, consumer_num, buffer, locks, put=None):
+    ring  = buffer.SHARDS[index]
+    shard = locks.SHARDS[index]
+    if ring.IN == ring.OUT: return None                                      # Peek without the lock, so scanning empty rings is cheap
+    with shard.consumer_buffer:
+        if ring.IN == ring.OUT: return None                                  # Someone else got there first
+        item         = ring.ITEM[ring.OUT]
+        producer_num = ring.PRODUCER[ring.OUT]
+        ring.OUT = (ring.OUT + 1) % ring.NUM_SLOTS
+        if put: put((item, producer_num, consumer_num))
+    with shard.not_full:                                                     # Tell one producer sleeping on that ring there is a free slot
+        shard.not_full.notify()
+    return item, producer_num
+
+
+# =======================================================================================================
+# Sharded consumer.  Drains its home ring, (consumer_num-1) % NUM_SHARDS, and when that is empty steals one item at a
+# time from the other rings.  Only when every ring is empty does it sleep, on the shared not_empty, until a producer
+# on any ring inserts.  It counts itself in locks.sleeping BEFORE looking at the rings one last time under that lock:
+# a producer that read 'sleeping' as 0 inserted before that look, so the item is seen, and one that read it as more
+# than 0 blocks on the lock until the consumer is waiting, so the notify isn't lost.  PRODUCERS_DONE is read BEFORE
+# the scan: if it was already set and every ring was empty, nothing can ever be inserted again, so the consumer can
+# stop without losing an item.
+
+def sharded_consumer(consumer_num, f_out, buffer, locks):
+    write_record = getattr(f_out, "write_record", None)                     # Binary output (-F bin) takes the 3 numbers as is
+    put          = getattr(f_out, "put", None)                              # Writer stage (-W) takes records inside the ring lock instead
+    home         = (consumer_num - 1) % buffer.NUM_SHARDS
+    order        = [(home + s) % buffer.NUM_SHARDS for s in range(buffer.NUM_SHARDS)]    # Home ring first, then the others round robin
+    while not buffer.KILL:
+        done  = buffer.PRODUCERS_DONE
+        taken = None
+        for index in order:
+            taken = take_from_shard(index, consumer_num, buffer, locks, put)
+            if taken: break
+        if not taken:
+            if done: return                                                  # Producers finished before the scan and every ring was empty
+            with locks.not_empty:
+                locks.sleeping += 1
+                if all([ring.IN == ring.OUT for ring in buffer.SHARDS]) and not buffer.PRODUCERS_DONE and not buffer.KILL:
+                    locks.not_empty.wait()                                   # Sleep until a producer on any ring adds data (or done/KILL), then re-scan
+                locks.sleeping -= 1
+            continue
+
+        if put: continue                                                     # Already handed off, no file lock
+        item, producer_num = taken
+        with locks.consumer_file_out:                                        # Lock f_out
+            if write_record: write_record(item, producer_num, consumer_num)
+            else:            f_out.write('%d\t%d\t%d\n' % (item, producer_num, consumer_num))
+
+
+
+# Default ways to open a run's input and output files
+def open_input(filename):  return open(filename, 'r')
+def open_output(filename): return records.open_output(filename)          # Text, or binary records for '.bin' names (-F bin)
+
+
+# Convenience class describing a producer/consumer implementation and the buffer/locks it expects.
+# buffer.py picks one of these via -e, so different implementations can be run and timed against the same configs.
+class engine_object:
+    def __init__(self, name, producer, consumer, make_buffer=buffer_object, make_locks=locks_object, description="",
+                 worker=threading.Thread, open_input=open_input, open_output=open_output, execute_run=None,
+                 batch_producer=None, batch_consumer=None, resolve=None, spsc=False):
+        self.name         = name             # Name used on the command line (-e)
+        self.producer     = producer         # Producer function, called as producer(producer_num, f_in, buffer, locks)
+        self.consumer     = consumer         # Consumer function, called as consumer(consumer_num, f_out, buffer, locks)
+        self.make_buffer  = make_buffer      # Called with the number of slots to build a fresh buffer for each run
+        self.make_locks   = make_locks       # Called to build fresh locks for each run.  Thread engines also take a lockstats.profile_object (-P).
+        self.description  = description      # One-liner for the -e help text
+        self.worker       = worker           # threading.Thread or multiprocessing.Process (same start/join interface)
+        self.open_input   = open_input       # Called with the input  filename, returns what producers get as f_in
+        self.open_output  = open_output      # Called with the output filename, returns what consumers get as f_out
+        self.execute_run  = execute_run      # Optional replacement for runner.execute_run, same arguments and (killed, timing) result
+        self.batch_producer = batch_producer # Optional producer/consumer pair used instead when -b asks for more than one item per lock hold
+        self.batch_consumer = batch_consumer
+        self.resolve      = resolve          # Optional resolve(config, options) that picks the real engine per config (see 'auto')
+        self.spsc         = spsc             # True if the engine is only correct with exactly one producer and one consumer
+
+
+# Registered engines, by name
+ENGINES = {}
+
+def register_engine(engine):
+    ENGINES[engine.name] = engine
+    return engine
+
+
+register_engine(engine_object("student",  student.student_producer, student.student_consumer, make_buffer=tuple_buffer_object,
+                              description="student.py functions (busy-wait spinning)"))
+register_engine(engine_object("blocking", blocking_producer, blocking_consumer, make_locks=blocking_locks_object,
+                              batch_producer=batch_producer, batch_consumer=batch_consumer,
+                              description="Condition 'not full'/'not empty' signalling, no spinning"))
+register_engine(engine_object("shm",      blocking_producer, blocking_consumer,
+                              make_buffer=shm_engine.shm_buffer_object, make_locks=shm_engine.shm_locks_object,
+                              worker=multiprocessing.Process, open_input=shm_engine.shm_input, open_output=shm_engine.shm_output,
+                              batch_producer=batch_producer, batch_consumer=batch_consumer,
+                              description="Blocking engine in producer/consumer PROCESSES over a multiprocessing.shared_memory ring"))
+register_engine(engine_object("async",    async_engine.async_producer, async_engine.async_consumer,
+                              execute_run=async_engine.execute_async_run,
+                              description="asyncio coroutine producers/consumers on one event loop (cheap with hundreds of -p/-c)"))
+register_engine(engine_object("spsc",     spsc_producer, spsc_consumer, make_locks=spsc_locks_object, spsc=True,
+                              description="Lock-free single-producer/single-consumer ring, Event waits (p1_c1 configs only)"))
+
+
+# For -e auto.  p1_c1 configs get the SPSC ring, everything else (or batch mode) the blocking engine.
+def resolve_auto(config, options):
+    if config.producers == 1 and config.consumers == 1 and options.batch == 1: return ENGINES["spsc"]
+    else:                                                                     return ENGINES["blocking"]
+
+register_engine(engine_object("auto",     None, None, resolve=resolve_auto,
+                              description="'spsc' for p1_c1 configs, 'blocking' for everything else"))
+
+# For -e sharded.  One ring per producer/consumer pair (-K overrides), so every ring has a home producer and consumer.
+def shard_count(config, options):
+    if options.shards: return max(1, min(options.shards, config.consumers))
+    else:              return max(1, min(config.producers, config.consumers))
+
+def resolve_sharded(config, options):
+    shards = min(shard_count(config, options), max(1, config.slots // 2))
+    return engine_object("sharded", sharded_producer, sharded_consumer,
+                         make_buffer=functools.partial(sharded_buffer_object, shards=shards),
+                         make_locks=functools.partial(sharded_locks_object, shards=shards),
+                         description=ENGINES["sharded"].description)
+
+register_engine(engine_object("sharded",  None, None, resolve=resolve_sharded,
+                              description="Blocking engine over one ring per producer/consumer pair (-K), idle consumers steal"))
+
+# For -e adaptive.  -s is the starting capacity, -D the range it may move in.
+def resolve_adaptive(config, options):
+    return engine_object("adaptive", adaptive_producer, adaptive_consumer, make_locks=blocking_locks_object,
+                         make_buffer=functools.partial(adaptive_buffer_object, min_slots=options.adapt[0], max_slots=options.adapt[1]),
+                         description=ENGINES["adaptive"].description)
+
+register_engine(engine_object("adaptive", None, None, resolve=resolve_adaptive,
+                              description="Blocking engine whose capacity grows/shrinks with occupancy, between -D min-max slots"))
+
+DEFAULT_ENGINE = "student"
+
+
+# Help text for -e, one line per registered engine
+def engines_help():
+    return "\n".join(["%-10s %s" % (name, ENGINES[name].description) for name in ENGINES])
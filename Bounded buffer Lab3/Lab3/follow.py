@@ -0,0 +1,150 @@
+import os
+import sys
+import time
+import analyze
+import records
+
+
+# Live follow mode (-f) for a run in progress, like 'tail -f' on its output file.
+#
+# Only the bytes appended since the last look are read, and only running counts are kept: items, out of order,
+# per producer/consumer counts, duplicates, invalid, and 'gaps', the expected items below the highest one seen that
+# haven't shown up yet (the missing items so far, give or take what's still in the buffer).  Lines are parsed with
+# records.text_row ('.bin' files with records.unpack_rows), so a corrupt line counts just like the full analysis counts it.
+#
+# A one line status is redrawn every FOLLOW_REFRESH seconds.  Following stops at the '-1 -1 -1' KILL line, at end of
+# file once every expected item has shown up, or at end of file when the file hasn't grown for longer than a run can
+# stall before it's killed.  A file that is truncated (the run was started again) is followed from the top.
+
+FOLLOW_REFRESH = 0.5                     # Seconds between status line redraws
+FOLLOW_POLL    = 0.05                    # Seconds to sleep at end of file before looking for more
+FOLLOW_BLOCK   = 1 << 20                 # Max bytes read per look, so a big backlog doesn't load all at once
+
+
+class follow_object:
+    out_of_order = analyze.run_results_object.out_of_order     # Same OOO rule as the full analysis
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.binary   = records.is_binary(filename)
+        self.producers, self.consumers, self.slots, self.num_expected, self.run_num = analyze.parts_from_filename(filename)
+        self.f        = None
+        self.reset()
+
+    def reset(self):
+        self.offset          = 0             # Bytes of the file consumed so far
+        self.partial         = b''           # A line (or record) that isn't all there yet
+        self.items           = 0
+        self.ooo_count       = 0
+        self.prev            = None
+        self.seen            = bytearray(self.num_expected+1)      # seen[item] is 1 once item 1..num_expected showed up
+        self.distinct        = 0
+        self.highest         = 0             # Highest expected item seen so far
+        self.duplicates      = 0
+        self.invalid         = 0
+        self.producer_counts = {}
+        self.consumer_counts = {}
+        self.killed          = False
+        self.started         = time.perf_counter()
+        self.last_growth     = self.started
+
+    def add_row(self, item, prod, cons):
+        if item < 0:
+            self.killed = True
+            return
+        self.items += 1
+        if 0 < item <= self.num_expected:
+            if self.seen[item]:
+                self.duplicates += 1
+            else:
+                self.seen[item] = 1
+                self.distinct  += 1
+                if item > self.highest: self.highest = item
+        else:
+            self.invalid += 1
+        self.producer_counts[prod] = self.producer_counts.get(prod, 0) + 1
+        self.consumer_counts[cons] = self.consumer_counts.get(cons, 0) + 1
+        if self.out_of_order(self.prev, item, self.items): self.ooo_count += 1
+        self.prev = item
+
+    def add_data(self, data, final=False):
+        data = self.partial + data
+        if self.binary:
+            whole        = len(data) - len(data) % records.RECORD.size
+            self.partial = data[whole:]
+            rows         = records.unpack_rows(data[:whole])
+        else:
+            lines        = data.split(b'\n')
+            self.partial = lines.pop()
+            if final and self.partial.strip(): lines.append(self.partial)    # Unterminated last line of a finished run
+            rows         = map(records.text_row, lines)
+        for row in rows:
+            self.add_row(*row)
+            if self.killed: return
+
+    # Read whatever was appended since the last call.  Returns True if the file grew.
+    def poll(self):
+        try:            size = os.stat(self.filename).st_size
+        except OSError: return False                          # Not there (yet)
+        if self.f is None or size < self.offset:              # First look, or truncated by a new run
+            if self.f: self.f.close()
+            self.f = open(self.filename, 'rb')
+            self.reset()                                      # Rate and idle time count from when the file showed up
+        grew = False
+        while not self.killed:
+            data = self.f.read(FOLLOW_BLOCK)
+            if not data: break
+            self.offset += len(data)
+            self.add_data(data)
+            grew = True
+        if grew: self.last_growth = time.perf_counter()
+        return grew
+
+    def close(self):
+        if self.f:
+            if not self.killed: self.add_data(b'', final=True)
+            self.f.close()
+
+    # min-max share of the items and how many are idle, across threads 1..count (or more, if more showed up)
+    def shares(self, counts, count):
+        count  = max([count] + list(counts))
+        shares = [analyze.percent(counts.get(n, 0), self.items) for n in range(1, count+1)]
+        if not shares: return "-"
+        return "%5.1f-%5.1f%% idle %d" % (min(shares), max(shares), shares.count(0))
+
+    def status(self):
+        elapsed = time.perf_counter() - self.started
+        return "%7.1fs  items %9d/%d %6.2f%%  %10.1f/s  OOO %6.2f%%  gaps %-6d dups %-6d invalid %-6d prod %s  cons %s" % (
+            elapsed, self.items, self.num_expected, analyze.percent(self.distinct, self.num_expected), self.items / elapsed if elapsed else 0,
+            analyze.percent(self.ooo_count, self.items), self.highest - self.distinct, self.duplicates, self.invalid,
+            self.shares(self.producer_counts, self.producers), self.shares(self.consumer_counts, self.consumers))
+
+
+# Entry point for buffer.py -f.  'idle' is how long the file may go without growing, while some expected items are
+# still missing, before the run is taken to be over (buffer.py passes -t plus -w, after which a live run is killed).
+def follow(filename, idle):
+    follower = follow_object(filename)
+    print("\n%s %s   (p=%d c=%d s=%d i=%d, status every %.1fs, Ctrl-C stops)" % (analyze.label("Following"), filename,
+          follower.producers, follower.consumers, follower.slots, follower.num_expected, FOLLOW_REFRESH))
+    label  = analyze.label("Follow")
+    reason = None
+    redraw = 0
+    try:
+        while reason is None:
+            grew = follower.poll()
+            now  = time.perf_counter()
+            if   follower.killed:                                           reason = "KILL marker"
+            elif grew or not follower.f:                                    pass
+            elif follower.distinct == follower.num_expected:                reason = "all %d items seen" % follower.num_expected
+            elif now - follower.last_growth > idle:                         reason = "no new output for %.1fs" % idle
+            if now >= redraw and not reason:
+                sys.stdout.write("\r%s %s " % (label, follower.status()) if follower.f else "\r%s waiting for '%s' " % (label, filename))
+                sys.stdout.flush()
+                redraw = now + FOLLOW_REFRESH
+            if reason is None and not grew: time.sleep(FOLLOW_POLL)
+    except KeyboardInterrupt:
+        reason = "interrupted"
+    follower.close()
+    print("\r%s %s " % (label, follower.status()))
+    print("%s %s" % (analyze.label("Stopped"), reason))
+    return follower
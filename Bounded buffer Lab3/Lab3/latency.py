@@ -0,0 +1,165 @@
+import os
+import time
+import array
+
+
+# Opt-in (-L) per-item latency instrumentation.
+#
+# Three timestamps per item, all time.perf_counter_ns():
+#   read    producer got the item from f_in      (right after LINE P-1)
+#   insert  item went into a buffer slot         (LINE P-3)
+#   remove  consumer took the item out of a slot (LINE C-1)
+#
+# They go to a side-channel file in LATENCY_DIR with the same name as the run's output file, so the 3-column
+# output file analyze grades is unchanged.  Queueing latency is remove - insert, end to end is remove - read.
+# The side file starts with the output file's size and mtime as it was written, so a later run of the same config
+# without -L (which rewrites the output file but leaves the side file alone) doesn't get the old latencies.
+
+LATENCY_DIR = 'latency'                  # Side-channel directory, next to input/ and output/
+PERCENTILES = [50, 90, 99]               # Reported along with the max
+
+
+# The side-channel file for a run's output file
+def latency_filename(output_file):
+    return os.path.join(LATENCY_DIR, os.path.basename(output_file))
+
+
+# (size, mtime_ns) of an output file, or None if it isn't there
+def output_identity(output_file):
+    try:            stat = os.stat(output_file)
+    except OSError: return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+# The side-channel file for an output file, if there is one and it was written for the output file as it is now
+def matching_latency_file(output_file):
+    filename = latency_filename(output_file)
+    try:
+        with open(filename, 'r') as f:
+            parts = f.readline().split()
+    except OSError:
+        return None
+    if parts[:2] != ["#", "output"]: return None            # Older side files have no identity line, can't tell
+    try:              identity = (int(parts[2]), int(parts[3]))
+    except Exception: return None
+    return filename if identity == output_identity(output_file) else None
+
+
+# Timestamp lists for one run.  list.append is atomic under the GIL, so producer and consumer threads share them without a lock.
+class recorder_object:
+    def __init__(self):
+        self.start   = time.perf_counter_ns()
+        self.reads   = []                # (item, ns) per line a producer read
+        self.inserts = []                # (item, ns) per slot write
+        self.removes = []                # (item, ns) per slot read
+
+
+# Stands in for f_in.  Stamps each line that turns into an item, exactly like LINE P-1 would.
+class latency_input:
+    def __init__(self, f_in, recorder):
+        self.f_in     = f_in
+        self.recorder = recorder
+
+    def readline(self):
+        line = self.f_in.readline()
+        try:              self.recorder.reads.append((int(line), time.perf_counter_ns()))
+        except Exception: pass                               # End of file or bad data, not an item
+        return line
+
+    def close(self):
+        self.f_in.close()
+
+
+# Stands in for buffer.ITEM.  The engines write and read ITEM once per item, and code using the buffer_object.ITEMS view
+# reaches it thru that, so stamping here catches LINE P-3 and LINE C-1 for every engine that uses buffer_object.
+class latency_column:
+    def __init__(self, column, recorder):
+        self.column   = column
+        self.recorder = recorder
+
+    def __len__(self):
+        return len(self.column)
+
+    def __getitem__(self, index):
+        item = self.column[index]
+        self.recorder.removes.append((item, time.perf_counter_ns()))
+        return item
+
+    def __setitem__(self, index, item):
+        self.column[index] = item
+        self.recorder.inserts.append((item, time.perf_counter_ns()))
+
+
+# Stands in for the student engine's list of (item, producer_num) tuples (engines.tuple_buffer_object, no ITEM column)
+class latency_slots(latency_column):
+    def __getitem__(self, index):
+        slot = self.column[index]
+        self.recorder.removes.append((slot[0], time.perf_counter_ns()))
+        return slot
+
+    def __setitem__(self, index, slot):
+        self.column[index] = slot
+        self.recorder.inserts.append((slot[0], time.perf_counter_ns()))
+
+
+# Hook a fresh recorder into a run's buffer (every ring of a sharded buffer) and input.  Returns the f_in the producers should get.
+def instrument(buffer, f_in, recorder):
+    for ring in getattr(buffer, "SHARDS", [buffer]):
+        if ring.ITEM is None: ring.ITEMS = latency_slots(ring.ITEMS, recorder)
+        else:                 ring.ITEM  = latency_column(ring.ITEM, recorder)
+    return latency_input(f_in, recorder)
+
+
+# Join the three lists by item and write one 'item <tab> read <tab> insert <tab> remove' line (ns since the run started)
+# per item that made it all the way thru.  Only the first stamp of each kind counts, so a stale re-read of an already
+# consumed slot doesn't move an item's remove time.  Items still in flight when a run is killed are left out.
+# Called once the output file is closed, so the identity line matches what analyze will find.
+def write_latency_file(output_file, recorder):
+    filename = latency_filename(output_file)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    firsts = []
+    for events in (recorder.reads, recorder.inserts, recorder.removes):
+        first = {}
+        for item, ns in list(events):
+            if item not in first: first[item] = ns - recorder.start
+        firsts.append(first)
+    reads, inserts, removes = firsts
+
+    size, mtime_ns = output_identity(output_file) or (-1, -1)
+    with open(filename, 'w') as f:
+        f.write("# output\t%d\t%d\n" % (size, mtime_ns))
+        f.write("# item\tread_ns\tinsert_ns\tremove_ns\n")
+        for item in sorted(removes):
+            if item in reads and item in inserts:
+                f.write("%d\t%d\t%d\t%d\n" % (item, reads[item], inserts[item], removes[item]))
+
+
+# Read a latency file back.  Returns (queueing, end_to_end) arrays of ns, in item order.  Every run keeps them until
+# the end, so they're int64 arrays (8 bytes a value) rather than lists of ints.
+def read_latency_file(filename):
+    queueing   = array.array('q')
+    end_to_end = array.array('q')
+    with open(filename, 'r') as f:
+        for line in f:
+            if line.startswith('#'): continue
+            try:              item, read, insert, remove = [int(part) for part in line.split()]
+            except Exception: continue                       # Torn last line of a killed run
+            queueing.append(remove - insert)
+            end_to_end.append(remove - read)
+    return queueing, end_to_end
+
+
+# p50/p90/p99/max of a list of ns values, nearest-rank
+def percentiles(values):
+    ordered = sorted(values)
+    result  = {}
+    for p in PERCENTILES:
+        result["p%d" % p] = ordered[max(0, -(-p * len(ordered) // 100) - 1)] if ordered else 0
+    result["max"] = ordered[-1] if ordered else 0
+    return result
+
+
+# One line summary in microseconds
+def as_str(values):
+    stats = percentiles(values)
+    return "   ".join(["%s=%10.1fus" % (name, stats[name] / 1000) for name in stats]) + "   (n=%d)" % len(values)
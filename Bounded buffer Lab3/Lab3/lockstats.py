@@ -0,0 +1,147 @@
+import csv
+import os
+import sys
+import time
+import threading
+
+
+# Opt-in (-P) lock profiling for the thread engines.
+#
+# locks_object builds its four locks thru engines.new_lock, which hands out profiled_lock wrappers when a run has a
+# profile_object.  Each wrapper has the same acquire/release/context manager interface as threading.Lock (so Conditions
+# built on it still work) and records, per lock and per thread: acquisitions, wait time to get the lock and hold time.
+
+LOCK_NAMES = ["producer_file_in", "producer_buffer", "consumer_buffer", "consumer_file_out"]   # Report order
+
+
+# Counters for one (lock, thread) pair, or a roll-up of several
+class lock_stat:
+    def __init__(self):
+        self.acquires   = 0
+        self.wait_total = 0.0            # Seconds spent in acquire() before getting the lock
+        self.wait_max   = 0.0
+        self.hold_total = 0.0            # Seconds between getting the lock and releasing it
+        self.hold_max   = 0.0
+
+    def add(self, other):
+        self.acquires   += other.acquires
+        self.wait_total += other.wait_total
+        self.wait_max    = max(self.wait_max, other.wait_max)
+        self.hold_total += other.hold_total
+        self.hold_max    = max(self.hold_max, other.hold_max)
+
+    def as_str(self):
+        return "acquires=%9d   wait total=%9.4fs max=%9.6fs   hold total=%9.4fs max=%9.6fs" % (self.acquires, self.wait_total, self.wait_max, self.hold_total, self.hold_max)
+
+
+# Every lock_stat for one run (or, after add(), for several runs): stats[lock name][thread name]
+class profile_object:
+    def __init__(self):
+        self.stats = {}
+
+    # Called by engines.new_lock for each lock a locks_object builds
+    def lock(self, name):
+        self.stats.setdefault(name, {})
+        return profiled_lock(name, self.stats[name])
+
+    def add(self, other):
+        for name, threads in other.stats.items():
+            for thread, stat in threads.items():
+                self.stats.setdefault(name, {}).setdefault(thread, lock_stat()).add(stat)
+
+    # Lock names in report order, then anything else
+    def names(self):
+        return [n for n in LOCK_NAMES if n in self.stats] + sorted([n for n in self.stats if n not in LOCK_NAMES])
+
+    def total(self, name):
+        total = lock_stat()
+        for stat in self.stats[name].values(): total.add(stat)
+        return total
+
+    # One line per lock, and with per_thread, one more per thread under it
+    def print_report(self, label, per_thread=False):
+        for name in self.names():
+            print("%s %-18s %-12s %s" % (label, name, "ALL", self.total(name).as_str()))
+            if per_thread:
+                for thread in sorted(self.stats[name]):
+                    print("%s %-18s %-12s %s" % (label, "", thread, self.stats[name][thread].as_str()))
+
+
+# Same interface as threading.Lock.  Only one thread holds it at a time, so the hold start and the stats updates
+# are all done while holding the real lock and need no extra locking.
+class profiled_lock:
+    def __init__(self, name, stats):
+        self.name     = name
+        self.lock     = threading.Lock()
+        self.stats    = stats            # thread name -> lock_stat, shared with the profile_object
+        self.held_at  = 0.0
+        self.owner    = None             # Thread ident and name of the current holder
+        self.holder   = None
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        got   = self.lock.acquire(blocking, timeout)
+        if got:
+            self.held_at = time.perf_counter()
+            self.owner   = threading.get_ident()
+            self.holder  = threading.current_thread().name
+            if self.holder not in self.stats: self.stats[self.holder] = lock_stat()
+            stat = self.stats[self.holder]
+            wait = self.held_at - start
+            stat.acquires   += 1
+            stat.wait_total += wait
+            if wait > stat.wait_max: stat.wait_max = wait
+        return got
+
+    def release(self):
+        if self.holder is not None:                       # Not held means the real release() below raises, same as threading.Lock
+            hold = time.perf_counter() - self.held_at
+            stat = self.stats[self.holder]                # Charged to whoever acquired it (a plain Lock may be released by another thread)
+            stat.hold_total += hold
+            if hold > stat.hold_max: stat.hold_max = hold
+            self.owner  = None
+            self.holder = None
+        self.lock.release()
+
+    def locked(self):
+        return self.lock.locked()
+
+    # threading.Condition asks this before wait()/notify().  Without it, Condition would probe with acquire(False)
+    # and every probe would show up as an acquisition.
+    def _is_owned(self):
+        return self.lock.locked() and self.owner == threading.get_ident()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+# Columns written by write_profile_csv, one row per (config, lock, thread)
+PROFILE_FIELDS = ["config", "key", "runs", "lock", "thread", "acquires", "wait_total", "wait_max", "hold_total", "hold_max"]
+
+# Append the profile of each config that has one to filename, writing the header first if the file is new
+def write_profile_csv(filename, configs):
+    try:
+        new_file = not os.path.exists(filename) or os.path.getsize(filename) == 0
+        f_csv    = open(filename, 'a', newline='')
+    except Exception as err:
+        print("\nERROR: Can't write lock profile file '%s'\n" % filename, file=sys.stderr)
+        print("Actual system error message: ", err, file=sys.stderr)
+        sys.exit(1)
+
+    writer = csv.writer(f_csv)
+    if new_file: writer.writerow(PROFILE_FIELDS)
+    rows = 0
+    for config in configs:
+        profile, runs = config.lock_profile()
+        if not profile: continue
+        for name in profile.names():
+            for thread, stat in [("ALL", profile.total(name))] + sorted(profile.stats[name].items()):
+                writer.writerow([config.name, config.key, runs, name, thread, stat.acquires,
+                                 "%.6f" % stat.wait_total, "%.6f" % stat.wait_max, "%.6f" % stat.hold_total, "%.6f" % stat.hold_max])
+                rows += 1
+    f_csv.close()
+    return rows
@@ -0,0 +1,199 @@
+import io
+import os
+import sys
+import mmap
+import array
+import struct
+
+try:                import numpy                 # Optional.  Output files are read a block of records at a time when it's there.
+except ImportError: numpy = None
+
+
+# Optional fixed-width binary run output (-F bin).
+#
+# A '.bin' output file holds one RECORD per consumed item: item, producer_num, consumer_num as little-endian int32s
+# (12 bytes, vs ~9 for a typical text line and far less work to write and read).
+# KILL is the same (-1, -1, -1) 'tuple' as in text output, just packed.  The extension is what tells analyze which
+# format a file is in, the rest of the name (config name and key) is the same as for '.txt' files.
+
+TEXT_EXT   = ".txt"
+BINARY_EXT = ".bin"
+FORMATS    = {"text": TEXT_EXT, "bin": BINARY_EXT}
+
+RECORD     = struct.Struct('<iii')
+
+
+def is_binary(filename):
+    return filename.endswith(BINARY_EXT)
+
+
+# Output handle for '.bin' files.  Engines that know about it call write_record() / pack_record() and skip the text
+# formatting.  write() still takes the usual '%d\t%d\t%d\n' text (student code at LINE C-3, the KILL line written by
+# the wrapper code), and packs it the same way analyze would have parsed it.  Bytes passed to write() go straight thru.
+class binary_output:
+    pack_record = RECORD.pack
+
+    def __init__(self, filename, mode='wb'):
+        self.f = open(filename, mode)
+
+    def write_record(self, item, producer_num, consumer_num):
+        self.f.write(RECORD.pack(item, producer_num, consumer_num))
+
+    def write(self, data):
+        if isinstance(data, (bytes, bytearray)):
+            self.f.write(data)
+            return
+        for line in data.splitlines():
+            parts = line.split()
+            if not parts: continue
+            values = []
+            for part in parts[:3]:
+                try:              values.append(int(part))
+                except Exception: values.append(0)
+            values += [0] * (3 - len(values))                # Missing parts default to zero, like get_part
+            if len(parts) > 3 and values[0] >= 0: values[0] = 0     # Corrupt line, same rule as the text analyzer
+            self.f.write(RECORD.pack(*values))
+
+    def flush(self):
+        self.f.flush()
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def close(self):
+        self.f.close()
+
+
+# Want to default 'bad' or 'missing' data to zero
+def get_part(parts, offset):
+    try:              val = int(parts[offset])    # Can fail if offset too large, or data no a string that can be turned into an int
+    except Exception: val = 0                     # On any error, just set the part to zero
+    return val
+
+
+# (item, producer, consumer) from one text output line.  Follow mode (follow.py) hands it bytes lines, which int() takes as well.
+def text_row(line):
+    parts = line.strip().split()     # The output should be a 'tuple' of  'item <tab> producer <tab> consumer'
+    item  = get_part(parts, 0)       # item should be in first position, 0
+
+    if len(parts) > 3 and item >= 0:
+        # A corrupt output line, like no file lock.  Even though there may be partially good data, including the 'item', mark the entire row as bad by setting item to 0 (e.g., invalid).
+        item = 0
+
+    prod = get_part(parts, 1)        # get producer.  I've run this code on previous labs, where it wasn't a tuple in the output.  So, default missing to zero.
+    cons = get_part(parts, 2)        # get consumer.  I've run this code on previous labs, where it wasn't a tuple in the output.  So, default missing to zero.
+    return item, prod, cons
+
+
+
+
+# Open a run's output file in the format its extension asks for
+def open_output(filename):
+    if is_binary(filename): return binary_output(filename)
+    else:                   return open(filename, 'w')
+
+
+BLOCK_RECORDS = 1 << 20                  # Records per read in binary_rows, so memory stays flat however big the file is
+
+# (item, producer, consumer) for each record of a '.bin' file, read BLOCK_RECORDS at a time.  A torn last record is dropped.
+def binary_rows(filename):
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(BLOCK_RECORDS * RECORD.size)
+            if len(data) < RECORD.size: return
+            yield from unpack_rows(data)
+
+
+# (item, producer, consumer) for each whole record in 'data'.  Bytes past the last whole record are ignored.
+def unpack_rows(data):
+    values = array.array('i')
+    values.frombytes(data[:len(data) - len(data) % RECORD.size])
+    if sys.byteorder == 'big': values.byteswap()            # Records are little-endian on disk
+    return zip(values[0::3], values[1::3], values[2::3])
+
+
+
+# Bulk readers, used by analyze when NumPy is there.  Each yields (items, producers, consumers) int64 arrays, one
+# block of records at a time, holding exactly the rows text_row (or binary_rows) would give one by one.
+
+TEXT_BLOCK = 1 << 22                     # Bytes of whole lines text_blocks tokenizes at a time
+
+if numpy is not None:
+    BYTE_KIND = numpy.zeros(256, dtype=numpy.uint8)     # 0 anything else, 1 digit, 2 '-', 3 blank or tab, 4 newline
+    BYTE_KIND[ord('0'):ord('9')+1] = 1
+    BYTE_KIND[ord('-')]            = 2
+    BYTE_KIND[[ord(' '), ord('\t')]] = 3
+    BYTE_KIND[ord('\n')]           = 4
+
+
+def output_blocks(filename):
+    if is_binary(filename): return binary_blocks(filename)
+    else:                   return text_blocks(filename)
+
+
+# The file is memory mapped and cut into TEXT_BLOCK pieces that end on a newline.
+def text_blocks(filename):
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0: return      # An empty file can't be mapped
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            start = 0
+            while start < len(data):
+                end   = data.find(b'\n', min(start + TEXT_BLOCK, len(data)) - 1) + 1 or len(data)
+                block = data[start:end]
+                start = end
+                yield tokenize_block(block) or text_block_rows(block)
+
+
+# One block tokenized at the bytes level, all at once: no str per line and no strip/split/int per field.  Every token
+# is parsed in one numpy.fromstring call, then the tokens are dealt out to lines by where the newlines are.  Returns
+# None for a block with anything int() might see differently (other characters, a '-' not leading digits, a number
+# too big for int64, which fromstring clamps), which text_block_rows then parses line by line.
+def tokenize_block(block):
+    kind  = BYTE_KIND[numpy.frombuffer(block, dtype=numpy.uint8)]
+    if not kind.all(): return None
+    blank       = kind >= 3
+    after_blank = numpy.concatenate(([True], blank[:-1]))
+    token_start = ~blank & after_blank
+    minus       = numpy.flatnonzero(kind == 2)
+    if len(minus) and (minus[-1] + 1 == len(kind) or not (token_start[minus] & (kind[minus + 1] == 1)).all()): return None
+
+    values   = numpy.fromstring(block, dtype=numpy.int64, sep=' ')
+    starts   = numpy.flatnonzero(token_start)
+    if len(values) != len(starts) or (numpy.abs(values) >= 10**18).any(): return None
+    newlines = numpy.flatnonzero(kind == 4)
+    lines    = len(newlines) + (block[-1:] != b'\n')          # An unterminated last line is still a line
+    if len(values) == 3 * len(newlines) == 3 * lines and (newlines > starts[2::3]).all() and (newlines[:-1] < starts[3::3]).all():
+        return values[0::3], values[1::3], values[2::3]        # The usual block, every line has its 3 fields
+
+    line_starts = numpy.concatenate(([0], newlines + 1))[:lines]
+    fields   = numpy.add.reduceat(token_start, line_starts, dtype=numpy.intp)     # Tokens per line
+    first    = numpy.cumsum(fields) - fields                   # Index of each line's first token
+    columns  = []
+    for n in range(3):                                         # Missing fields are 0, like get_part
+        column = numpy.zeros(lines, dtype=numpy.int64)
+        has    = fields > n
+        column[has] = values[first[has] + n]
+        columns.append(column)
+    items, prods, conss = columns
+    items[(fields > 3) & (items >= 0)] = 0                     # Corrupt line, same rule as text_row
+    return items, prods, conss
+
+
+# A block tokenize_block passed on, read the way analyze reads a text file (default encoding, universal newlines).
+# Numbers too big for int64 stay Python ints, in object arrays.
+def text_block_rows(block):
+    rows = [text_row(line) for line in io.TextIOWrapper(io.BytesIO(block))] or numpy.zeros((0, 3), dtype=numpy.int64)
+    try:                  items, prods, conss = numpy.array(rows, dtype=numpy.int64).T
+    except OverflowError: items, prods, conss = numpy.array(rows, dtype=object).T
+    return items, prods, conss
+
+
+def binary_blocks(filename):
+    with open(filename, 'rb') as f:
+        whole = os.fstat(f.fileno()).st_size // RECORD.size * RECORD.size     # A torn last record is dropped
+        if whole == 0: return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for start in range(0, whole, BLOCK_RECORDS * RECORD.size):
+                count  = min(BLOCK_RECORDS * RECORD.size, whole - start) // 4
+                values = numpy.frombuffer(data, dtype='<i4', count=count, offset=start).astype(numpy.int64).reshape(-1, 3)
+                yield values[:, 0], values[:, 1], values[:, 2]
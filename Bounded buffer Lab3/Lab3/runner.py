@@ -0,0 +1,458 @@
+import threading
+import sys
+import os
+import io
+import time
+import contextlib
+import multiprocessing
+import hashlib
+import gc
+import traceback
+import analyze
+import latency
+import lockstats
+import writer
+
+
+# Sets KILL to True in buffer, and writes 3-part 'tuple' to OUTPUT_FILE to show KILL happened
+def kill_buffer(a_buffer, f_out, locks=None):
+    a_buffer.KILL = True
+    if locks: locks.wake_all()                                              # Blocking engines sleep on the buffer, wake them so they see KILL
+    try:
+        f_out.write('%d\t%d\t%d\n' % (-1, -1, -1))
+        f_out.flush()
+    except Exception as err:
+        print("\nERROR: Failed to cleanly write KILL tuple to file.  Grade for this run may be inflated.\n", file=sys.stderr)
+        print("Actual system error message: ", err, file=sys.stderr)
+
+
+
+WATCHDOG_POLL = 0.1                                            # Longest a bounded join waits before re-checking the watchdog deadline
+
+
+# Watchdog that replaces the old sleeping timer thread.  It sleeps on an Event instead of time.sleep, so it wakes up the moment
+# the wrapper code calls finish() (all threads done) and never holds up anything after a clean run.  While waiting it samples
+# progress: IN, OUT and the output file size.  Threads running student code can't be asked to report in, so that sample is the
+# heartbeat.  If it hasn't changed for 'stall' seconds (0 = never), the run is declared stalled and killed early instead of
+# waiting out the full timeout.  deadline() tells the bounded joins when to give up on threads that ignore KILL.
+class watchdog_object:
+    def __init__(self, timeout, stall, grace, f_out, a_buffer, locks, worker=threading.Thread):
+        self.timeout   = timeout             # Seconds before KILL is set no matter what
+        self.stall     = stall               # Seconds without progress before KILL is set early (0 = off)
+        self.grace     = grace               # Seconds threads get to notice KILL before they are abandoned
+        self.f_out     = f_out
+        self.a_buffer  = a_buffer
+        self.locks     = locks
+        self.threads   = []                  # Threads/processes being watched, for the 'still running' report
+        self.finished  = threading.Event()   # Set by finish() once every thread has been joined
+        self.started   = time.monotonic()
+        self.killed_at = None                # When KILL was set by the watchdog, if it was
+        self.thread    = worker(target=self.watch, name="Timer", daemon=True)   # worker is threading.Thread, or a worker_pool_object's worker (-R)
+
+    def start(self, threads):
+        self.threads = threads
+        self.thread.start()
+
+    def finish(self):
+        self.finished.set()
+
+    # Latest time the wrapper code should keep waiting on threads
+    def deadline(self):
+        if self.killed_at: return self.killed_at + self.grace
+        else:              return self.started + self.timeout + self.grace
+
+    # One sample of run progress.  Any change means at least one item moved.
+    def progress(self):
+        try:              size = os.fstat(self.f_out.fileno()).st_size
+        except Exception: size = 0
+        return (self.a_buffer.IN, self.a_buffer.OUT, size)
+
+    def watch(self):
+        if self.stall: poll = min(self.stall / 10, WATCHDOG_POLL)
+        else:          poll = self.timeout
+        last       = self.progress()
+        last_moved = self.started
+        while True:
+            if self.finished.wait(min(poll, max(0, self.started + self.timeout - time.monotonic()))):
+                return                                         # Every thread finished, nothing to do
+            now = time.monotonic()
+            if now - self.started >= self.timeout:
+                reason = "Expired."
+                break
+            sample = self.progress()
+            if sample != last:
+                last, last_moved = sample, now
+            elif self.stall and now - last_moved >= self.stall:
+                reason = "Stalled.  No item moved for %.2fs." % (now - last_moved)
+                break
+
+        running = [worker_name(t) for t in self.threads if worker_alive(t)]
+        print("%s %s" % (analyze.label("Timer"), reason + "  Setting buffer.KILL=True to stop threads and marking run as killed.  If threads don't gracefully stop, enter Control-C to forcefully stop them."))
+        print("%s %s" % (analyze.label("Still running"), ", ".join(running) if running else "(none)"))
+        self.killed_at = time.monotonic()
+        kill_buffer(self.a_buffer, self.f_out, self.locks)
+
+
+
+# The watchdog also watches asyncio tasks, which name and report liveness differently than threads/processes
+def worker_name(t):
+    if hasattr(t, "get_name"): return t.get_name()
+    else:                      return t.name
+
+def worker_alive(t):
+    if hasattr(t, "done"): return not t.done()
+    else:                  return t.is_alive()
+
+
+# Join each thread, but never past the watchdog's deadline.  Returns the threads still alive when time ran out.
+def join_bounded(threads, watchdog):
+    for t in threads:
+        while t.is_alive():
+            remaining = watchdog.deadline() - time.monotonic()
+            if remaining <= 0: break
+            t.join(min(remaining, WATCHDOG_POLL))
+    return [t for t in threads if t.is_alive()]
+
+
+# Give up on threads that ignored KILL for the whole grace period.  Threads are daemons, so they can't hold up exit.
+# Processes can be stopped outright.
+def abandon(threads):
+    if not threads: return
+    print("%s %d did not stop within the grace period, abandoning: %s" % (analyze.label("Threads"), len(threads), ", ".join([worker_name(t) for t in threads])))
+    for t in threads:
+        if   hasattr(t, "terminate"): t.terminate()           # multiprocessing.Process
+        elif hasattr(t, "cancel"):    t.cancel()              # asyncio.Task
+
+
+
+# A persistent thread that runs one pooled_task after another for a worker_pool_object
+class pool_thread_object:
+    def __init__(self, pool):
+        self.pool   = pool
+        self.task   = None
+        self.ready  = threading.Event()      # Set by the pool once self.task has been filled in
+        self.thread = threading.Thread(target=self.loop, name="Pool-%d" % (len(pool.threads)+1), daemon=True)
+        self.thread.start()
+
+    def loop(self):
+        while True:
+            self.ready.wait()
+            self.ready.clear()
+            task, self.task = self.task, None
+            self.thread.name = task.name                       # So lock profiles, stack dumps, etc. still see 'Producer-1' and so on
+            task.started.set()
+            try:
+                task.target(*task.args)
+            except Exception:
+                print("Exception in thread %s:" % task.name, file=sys.stderr)
+                traceback.print_exc()
+            task.target = task.args = None                     # Don't keep the run's buffer/locks/files alive
+            self.pool.idle.append(self)                        # Back in the pool before anyone is told this task is done
+            task.finished.set()
+
+
+# Stands in for a threading.Thread in start_threads/join_bounded: start(), is_alive(), join(timeout) and name,
+# but start() hands the target to an idle pool thread instead of creating one.
+class pooled_task:
+    def __init__(self, pool, target, args=(), name=None, daemon=True):
+        self.pool     = pool
+        self.target   = target
+        self.args     = args
+        self.name     = name
+        self.started  = threading.Event()
+        self.finished = threading.Event()    # Not 'done', that name is how worker_alive() spots an asyncio task
+
+    # Like Thread.start(), doesn't return until the target is running, so odd/even start order means the same thing
+    def start(self):
+        self.pool.submit(self)
+        self.started.wait()
+
+    def is_alive(self):
+        return self.started.is_set() and not self.finished.is_set()
+
+    def join(self, timeout=None):
+        self.finished.wait(timeout)
+
+
+# Reusable worker threads (-R).  Runs get their threads from here instead of creating and discarding
+# config.producers + config.consumers + 1 threads each time.  Threads only come back once their target returns,
+# so a thread abandoned after KILL is never handed a new run's work while it is still stuck in the old one.
+# Every run still gets a fresh buffer and fresh locks, so nothing carries over but the OS threads.
+class worker_pool_object:
+    def __init__(self):
+        self.threads = []                    # Every thread ever created
+        self.idle    = []                    # Threads waiting for work.  list append/pop are atomic, no lock needed.
+        self.tasks   = 0
+        self.lock    = threading.Lock()      # Only for growing the pool
+
+    # Same call signature as threading.Thread, so it can be passed as the worker to start_threads/watchdog_object
+    def worker(self, target, args=(), name=None, daemon=True):
+        return pooled_task(self, target, args, name, daemon)
+
+    def submit(self, task):
+        try:
+            thread = self.idle.pop()
+        except IndexError:
+            with self.lock:
+                thread = pool_thread_object(self)
+                self.threads.append(thread)
+        self.tasks  += 1
+        thread.task  = task
+        thread.ready.set()
+
+    def summary(self):
+        return "%d threads served %d producer/consumer/timer tasks" % (len(self.threads), self.tasks)
+
+
+worker_pool = None                                             # The process's worker_pool_object, created on first use by -R
+
+def get_worker_pool():
+    global worker_pool
+    if worker_pool is None: worker_pool = worker_pool_object()
+    return worker_pool
+
+
+
+INPUT_CHUNK = 1000000                                          # Items generated per write when building an input file
+
+# Input files only depend on the number of items, so configs with the same item count share one, kept here by item count
+input_files = {}
+
+
+# Size in bytes of an input file holding "1\n" thru "items\n", without having to build it
+def input_file_size(items):
+    size   = 0
+    digits = 1
+    while 10**(digits-1) <= items:
+        size   += (min(items, 10**digits - 1) - 10**(digits-1) + 1) * (digits+1)    # every number with this many digits, plus its newline
+        digits += 1
+    return size
+
+
+# sha256 of a file, read in large blocks
+def file_digest(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Find or build the input file for 'items' in input_dir.  Returns (filename, how), where how is "shared", "reused" or "created".
+# A file on disk is reused when its size is right and its contents still hash to what was recorded (in a .sha256 file
+# next to it) when it was written.  Otherwise it is rewritten, INPUT_CHUNK lines per write call.
+def prepare_input_file(input_dir, items):
+    if items in input_files: return input_files[items], "shared"
+
+    filename    = "%s/items_i%d.txt" % (input_dir, items)
+    digest_file = filename + ".sha256"
+    try:
+        with open(digest_file, 'r') as f: recorded = f.read().strip()
+        if os.path.getsize(filename) == input_file_size(items) and file_digest(filename) == recorded:
+            input_files[items] = filename
+            return filename, "reused"
+    except Exception:
+        pass                                                   # No digest, no file, or can't read one of them.  Just rebuild.
+
+    digest = hashlib.sha256()
+    with open(filename, 'wb') as f:                            # Create the input file
+        for start in range(1, items+1, INPUT_CHUNK):           # Build a chunk of 'items' at a time...
+            block = ("\n".join(map(str, range(start, min(start+INPUT_CHUNK, items+1)))) + "\n").encode()
+            f.write(block)                                     # ... and put it out with one write
+            digest.update(block)
+    with open(digest_file, 'w') as f:
+        f.write(digest.hexdigest() + "\n")
+    input_files[items] = filename
+    return filename, "created"
+
+
+
+# Convenience class for the per-run settings that come from the command line rather than the config,
+# so they can be handed to execute_run (and to worker processes) all at once
+class run_options_object:
+    def __init__(self, batch=1, stall=0, grace=1, latency=False, profile=False, writer=False, reuse=False, shards=0, adapt=(2, 4096)):
+        self.batch   = batch                 # Lines claimed per input lock hold / slots drained per buffer lock hold (-b)
+        self.stall   = stall                 # Seconds without progress before the watchdog kills a run early, 0 = off (-S)
+        self.grace   = grace                 # Seconds threads get to stop after KILL before they are abandoned (-w)
+        self.latency = latency               # Record per-item read/insert/remove times to a latency/ side file (-L)
+        self.profile = profile               # Swap in profiled locks that count acquisitions and wait/hold times (-P)
+        self.writer  = writer                # Consumers hand records to one writer thread instead of writing f_out themselves (-W)
+        self.reuse   = reuse                 # Run producers/consumers/timer on reused pool threads instead of new ones (-R)
+        self.shards  = shards                # Rings for -e sharded, 0 = one per producer/consumer pair (-K)
+        self.adapt   = adapt                 # (min, max) slots -e adaptive may resize between (-D)
+
+
+
+# Garbage collector passes so far, all generations.  Every pass means ~700 more container objects (tuples, lists, ...) were
+# allocated than freed, so the count during a run is a cheap allocation gauge.
+def gc_collections():
+    return sum([generation["collections"] for generation in gc.get_stats()])
+
+
+# Snapshot of the clocks used to time a run
+def start_timing():
+    return time.perf_counter(), os.times(), gc_collections()
+
+
+# Build the run_timing for everything since start_timing().
+# Joined child processes (process engines) show up in the children_* fields of os.times().  Their GC passes don't show up anywhere.
+def stop_timing(engine, start):
+    start_wall, start_times, start_gcs = start
+    end_times = os.times()
+    return analyze.run_timing(engine.name, time.perf_counter() - start_wall,
+                              (end_times.user   + end_times.children_user)   - (start_times.user   + start_times.children_user),
+                              (end_times.system + end_times.children_system) - (start_times.system + start_times.children_system),
+                              gc_collections() - start_gcs)
+
+
+
+# Create and start 'count' workers running 'target', appending them to 'threads'.  kind is "Producer" or "Consumer".
+# worker is the engine's worker class, threading.Thread or multiprocessing.Process.
+def start_threads(kind, count, target, f, a_buffer, locks, threads, worker=threading.Thread):
+    print("%s Starting %d %ss using '%s' ..." % (analyze.label("Threads"), count, kind.lower(), target.__name__))
+    for x in range(count):
+        thread = worker(target=target, args=(x+1,f,a_buffer,locks), name="%s-%d" % (kind, x+1), daemon=True)   # Setup thread, function, args, and name.  Daemon so an abandoned one can't block exit.
+        threads.append(thread)                                 # Add new thread to the caller's list
+        thread.start()                                         # Start the new thread
+
+
+
+# Execute one run of a config: start the threads, wait for them, and close the output file.
+# Returns (killed, timing).  timing is None if the run was stopped with Control-C.
+def execute_run(config, run, engine, p_target, c_target, input_file, output_file, options):
+    if engine.execute_run:                                     # Engines that don't fit the thread/process model (e.g., asyncio) run themselves
+        return engine.execute_run(config, run, engine, p_target, c_target, input_file, output_file, options)
+
+    aBuffer = engine.make_buffer(config.slots)                 # Create a new buffer for each run, to avoid bad spill-over info
+    aBuffer.BATCH = options.batch                              # Items per lock hold, only looked at by the batch producer/consumer functions
+    profile = lockstats.profile_object() if options.profile else None
+    if profile: locks = engine.make_locks(profile)             # Same locks, wrapped to record wait/hold times
+    else:       locks = engine.make_locks()                    # Create new locks for each run, to avoid spill-over
+    timing  = None                                             # Only set when the run finishes normally (not on Control-C)
+    recorder = latency.recorder_object() if options.latency else None
+
+    try:
+        producer_threads   = []                                # list to help manage producer threads for this run
+        consumer_threads   = []                                # list to help manage consumer threads for this run
+
+        f_in  = engine.open_input(input_file)                  # Open   READ  input  file handle
+        f_out = engine.open_output(output_file)                # Create WRITE output file handle
+        if options.writer: f_out = writer.writer_stage(f_out)  # One writer thread owns the file, consumers just hand records off
+        if recorder: f_in = latency.instrument(aBuffer, f_in, recorder)   # Stamp items as they are read, inserted and removed
+
+        start = start_timing()                                 # Start timing right before the first thread starts
+
+        worker = engine.worker
+        if options.reuse and worker is threading.Thread: worker = get_worker_pool().worker    # Same interface, reused threads
+
+        if run % 2:                                            # On Odd numbered runs, start producer first
+            start_threads("Producer", config.producers, p_target, f_in,  aBuffer, locks, producer_threads, worker)
+            start_threads("Consumer", config.consumers, c_target, f_out, aBuffer, locks, consumer_threads, worker)
+        else:                                                  # On Even numbered runs, start consumer first
+            start_threads("Consumer", config.consumers, c_target, f_out, aBuffer, locks, consumer_threads, worker)
+            start_threads("Producer", config.producers, p_target, f_in,  aBuffer, locks, producer_threads, worker)
+
+        timer    = worker if worker is not multiprocessing.Process else threading.Thread    # The timer is always a thread in this process
+        watchdog = watchdog_object(config.timeout, options.stall, options.grace, f_out, aBuffer, locks, timer)
+        watchdog.start(producer_threads + consumer_threads)   # Start the watchdog (replaces the old timer thread)
+
+        stuck = join_bounded(producer_threads, watchdog)       # Wait for each individual producer thread, up to the deadline
+        aBuffer.PRODUCERS_DONE = True                          # Let consumer threads know the producer threads are done
+        locks.wake_all()                                       # Wake any consumer sleeping on an empty buffer so it sees PRODUCERS_DONE
+        print("%s Producers done." % analyze.label("Threads"))
+
+        stuck += join_bounded(consumer_threads, watchdog)      # Wait for each individual consumer thread, up to the deadline
+        aBuffer.CONSUMERS_DONE = True                          # Let the watchdog know the consumer threads are done
+        watchdog.finish()
+        abandon(stuck)
+        print("%s Consumers done." % analyze.label("Threads"))
+
+        if options.writer: f_out.flush()                       # The writer's backlog is part of the run, time it too
+        timing = stop_timing(engine, start)
+        timing.locks = profile                                 # Lock profile rides along with the timing (None unless -P)
+        timing.slots = getattr(aBuffer, "TRAJECTORY", None)    # Capacity over time (only -e adaptive resizes)
+
+        if aBuffer.KILL:
+            f_out.write('%d\t%d\t%d\n' % (-1, -1, -1))         # Writes 3-part 'tuple' to OUTPUT_FILE to show KILL happened
+        f_out.close()                                          # Close the raw output file
+        f_in.close()
+
+
+    except KeyboardInterrupt:
+        print("\n\nControl-C from terminal captured by buffer.py.  Setting 'aBuffer.KILL = True'")
+        print("so the main loops in the producer and consumer functions see this and gracefully terminate.")
+        print("If your code is stuck in a tight inner infinite loop, you'll probably have to press")
+        print("Control-C again multiple times to kill everything more forcefully.\n\n")
+
+        print("If the program doesn't gracefully stop, you can try to get an analysis of this run by entering:\n")
+        print("    python3 buffer.py -A %s\n\n" % output_file)
+
+        kill_buffer(aBuffer, f_out, locks)                     # Sets buffer.KILL and notes that in f_out
+
+        for p in producer_threads: p.join()                    # Wait for each individual producer thread
+        aBuffer.PRODUCERS_DONE = True                          # Let consumer threads know the producer threads are done
+        locks.wake_all()
+        print("Producer threads stopped.")
+
+        for c in consumer_threads: c.join()                    # Wait for each individual consumer thread
+        aBuffer.CONSUMERS_DONE = True                          # Let timer thread know the consumer threads are done
+        print("Consumer threads stopped.")
+        f_out.close()                                          # Close the raw output file
+
+        print("\nCalling analyze after user interrupt.")
+        print("If you think you broke out of an infinite loop, there may be a lot of data to analyze.")
+        print("If you don't want to wait on that analysis, enter Control-C again.\n\n")
+
+    if recorder: latency.write_latency_file(output_file, recorder)
+    killed = aBuffer.KILL
+    aBuffer.release()                                          # Give back anything the buffer holds outside this process (e.g., shared memory)
+    return killed, timing
+
+
+
+# Convenience class for one (config, run) pair handed to a worker process by run_tasks_in_pool
+class run_task_object:
+    def __init__(self, config, run, overall, engine, p_target, c_target, input_file, output_file, options, target_ooo, plot=False):
+        self.config       = config           # config_object for the run.  The worker gets a copy, the parent keeps the original to merge into.
+        self.run          = run              # Run number within the config (odd/even decides start order)
+        self.overall      = overall          # Overall test number, so headers match a serial run
+        self.engine       = engine
+        self.p_target     = p_target
+        self.c_target     = c_target
+        self.input_file   = input_file
+        self.output_file  = output_file
+        self.options      = options
+        self.target_ooo   = target_ooo       # Workers may not inherit analyze.TARGET_OOO (e.g., 'spawn' start method), so pass it along
+        self.plot         = plot             # Keep the plot data, the parent graphs the run (-m)
+
+
+
+# Worker side: execute and analyze one run, capturing everything it prints so the parent can replay it in order.
+# Graphs are never shown from a worker, the parent does that after merging.
+def run_task(task):
+    analyze.TARGET_OOO = task.target_ooo
+    text = io.StringIO()
+    with contextlib.redirect_stdout(text):
+        task.config.print_run_header(task.overall, task.run)
+        killed, timing = execute_run(task.config, task.run, task.engine, task.p_target, task.c_target, task.input_file, task.output_file, task.options)
+        results = task.config.add_run(task.output_file, killed, False, print_details=True, print_section_start=False, timing=timing,
+                                      latency_file=latency.latency_filename(task.output_file) if task.options.latency else None, plot=task.plot)
+    return text.getvalue(), results
+
+
+
+# Parent side: run every task across 'jobs' worker processes.  Results come back in task order (imap, not
+# imap_unordered), so each run's output is printed and merged into its config exactly where a serial run would have.
+# before_config(config) is called before a config's first run is replayed, after_config(config) once its last run has been merged.
+def run_tasks_in_pool(tasks, jobs, graph, after_config, before_config=None):
+    with multiprocessing.Pool(jobs) as pool:
+        for i, (text, results) in enumerate(pool.imap(run_task, tasks)):
+            task = tasks[i]
+            if before_config and (i == 0 or tasks[i-1].config is not task.config):
+                before_config(task.config)                     # e.g., the config's Input line, where a serial run prints it
+            sys.stdout.write(text)                             # Replay what the worker printed for this run
+            task.config.merge_run(results)                     # Merge into the parent's config, same as add_run would have
+            if graph: results.show_graph()
+            results.release_details()
+            if i+1 == len(tasks) or tasks[i+1].config is not task.config:
+                after_config(task.config)
@@ -0,0 +1,180 @@
+import os
+import multiprocessing
+from multiprocessing import shared_memory
+import records
+
+
+# Layout of the shared int64 array.  The header fields come first, then NUM_SLOTS (item, producer_num) pairs.
+HDR_IN              = 0
+HDR_OUT             = 1
+HDR_KILL            = 2
+HDR_PRODUCERS_DONE  = 3
+HDR_CONSUMERS_DONE  = 4
+HDR_SIZE            = 5
+WORD                = 8                                   # bytes per int64 ('q')
+
+
+# Tuple-style view over the item/producer columns in the shared array, so 'buffer.ITEMS[i] = (item, producer_num)'
+# and '(item, producer_num) = buffer.ITEMS[i]' work the same as with engines.buffer_object.
+class shm_items_view:
+    def __init__(self, items, producers):
+        self.items     = items
+        self.producers = producers
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return (self.items[index], self.producers[index])
+
+    def __setitem__(self, index, value):
+        self.items[index], self.producers[index] = value
+
+
+# Property for one header field in the shared array.  Flags are stored as 0/1 but read back as bools.
+def shared_field(index, as_bool=False):
+    def get(self):
+        if self.array is None: value = self.final[index]       # After release(), answer from the snapshot (e.g., a late timer thread check)
+        else:                  value = self.array[index]
+        if as_bool: return bool(value)
+        else:       return value
+    def set(self, value):
+        if self.array is None: self.final[index] = int(value)
+        else:                  self.array[index] = int(value)
+    return property(get, set)
+
+
+# Same fields as buffer_object, but IN/OUT/KILL/PRODUCERS_DONE/CONSUMERS_DONE and ITEMS live in one
+# multiprocessing.shared_memory block, so producer and consumer PROCESSES all see the same ring.
+class shm_buffer_object:
+    def __init__(self, slots):
+        self.NUM_SLOTS = slots
+        self.shm       = shared_memory.SharedMemory(create=True, size=WORD * (HDR_SIZE + 2*slots))
+        self.owner     = os.getpid()                      # Only the creating process unlinks the block
+        self.attach()
+        for i in range(HDR_SIZE + 2*slots): self.array[i] = 0
+
+    def attach(self):
+        self.array    = self.shm.buf.cast('q')            # Fixed-width int64 view over the shared bytes
+        self.ITEM     = self.array[HDR_SIZE::2]           # Item column, every other word after the header (same ITEM/PRODUCER columns as buffer_object)
+        self.PRODUCER = self.array[HDR_SIZE+1::2]         # Producer number column
+        self.ITEMS    = shm_items_view(self.ITEM, self.PRODUCER)
+
+    # Only needed with the 'spawn' start method, where the buffer is pickled to the child.  Re-attach by name there.
+    def __getstate__(self):
+        return (self.NUM_SLOTS, self.shm.name, self.owner)
+
+    def __setstate__(self, state):
+        self.NUM_SLOTS, name, self.owner = state
+        self.shm = shared_memory.SharedMemory(name=name)
+        self.attach()
+
+    # Called by the wrapper code once every process has been joined
+    def release(self):
+        self.final = list(self.array[:HDR_SIZE])               # Keep the header values around for anyone still looking
+        self.ITEMS = None
+        self.ITEM.release()                                    # The column views hold the block too, so they go first
+        self.PRODUCER.release()
+        self.array.release()
+        self.array = None
+        self.shm.close()
+        if os.getpid() == self.owner: self.shm.unlink()
+
+    IN             = shared_field(HDR_IN)
+    OUT            = shared_field(HDR_OUT)
+    KILL           = shared_field(HDR_KILL,           as_bool=True)
+    PRODUCERS_DONE = shared_field(HDR_PRODUCERS_DONE, as_bool=True)
+    CONSUMERS_DONE = shared_field(HDR_CONSUMERS_DONE, as_bool=True)
+
+
+# Same names as locks_object/blocking_locks_object, but process-shared, so the blocking engine functions run unchanged in processes
+class shm_locks_object:
+    def __init__(self):
+        self.producer_file_in   = multiprocessing.Lock()  # producer lock for INPUT_FILE  access
+        self.consumer_file_out  = multiprocessing.Lock()  # consumer lock for OUTPUT_FILE access
+
+        self.producer_buffer    = multiprocessing.Lock()  # producer lock for buffer access
+        self.consumer_buffer    = multiprocessing.Lock()  # consumer lock for buffer access
+
+        self.not_full           = multiprocessing.Condition(self.producer_buffer)   # producers wait here when the buffer is full
+        self.not_empty          = multiprocessing.Condition(self.consumer_buffer)   # consumers wait here when the buffer is empty
+
+    # Wake every waiting process so it re-checks buffer.KILL and buffer.PRODUCERS_DONE
+    def wake_all(self):
+        with self.not_full:  self.not_full.notify_all()
+        with self.not_empty: self.not_empty.notify_all()
+
+
+
+# Input file shared by producer processes.  A file handle's position isn't shared across processes, so the
+# next read offset is kept in shared memory instead.  readline() must be called under locks.producer_file_in,
+# which every producer already does.  Lines come back as bytes; int() accepts those just like str.
+class shm_input:
+    def __init__(self, filename):
+        self.filename = filename
+        self.offset   = multiprocessing.Value('q', 0, lock=False)   # Protected by producer_file_in, no extra lock needed
+        self.f        = None
+        self.pid      = None
+
+    def __getstate__(self):                               # 'spawn' start method: send the name and shared offset, not the open handle
+        return (self.filename, self.offset)
+
+    def __setstate__(self, state):
+        self.filename, self.offset = state
+        self.f   = None
+        self.pid = None
+
+    def readline(self):
+        if self.pid != os.getpid():                       # First read in this process, open a private handle
+            self.f   = open(self.filename, 'rb')
+            self.pid = os.getpid()
+        self.f.seek(self.offset.value)
+        line = self.f.readline()
+        self.offset.value = self.f.tell()
+        return line
+
+    def close(self):
+        if self.f: self.f.close()
+
+
+# Output file shared by consumer processes.  Each process appends through its own handle and flushes every write,
+# so records land in the file in the order consumer_file_out was acquired, the same as with threads.
+# '.bin' names get records.binary_output handles, and the write_record/pack_record fast paths the engines look for.
+class shm_output:
+    def __init__(self, filename):
+        open(filename, 'w').close()                       # Truncate once in the parent, everyone appends after that
+        self.__setstate__(filename)
+
+    def __getstate__(self):                               # 'spawn' start method: send the name, not the open handle
+        return self.filename
+
+    def __setstate__(self, state):
+        self.filename = state
+        self.f        = None
+        self.pid      = None
+        if records.is_binary(self.filename):
+            self.write_record = self.append_record
+            self.pack_record  = records.RECORD.pack
+
+    def handle(self):
+        if self.pid != os.getpid():                       # First write in this process, open a private append handle
+            if records.is_binary(self.filename): self.f = records.binary_output(self.filename, 'ab')
+            else:                                self.f = open(self.filename, 'a')
+            self.pid = os.getpid()
+        return self.f
+
+    def write(self, text):
+        f = self.handle()
+        f.write(text)
+        f.flush()
+
+    def append_record(self, item, producer_num, consumer_num):
+        f = self.handle()
+        f.write_record(item, producer_num, consumer_num)
+        f.flush()
+
+    def flush(self):
+        if self.f: self.f.flush()
+
+    def close(self):
+        if self.f: self.f.close()
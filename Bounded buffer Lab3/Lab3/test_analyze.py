@@ -0,0 +1,36 @@
+import os
+import pytest
+import analyze
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# Every test starts with no configs, like a fresh buffer.py
+@pytest.fixture(autouse=True)
+def fresh_configs(monkeypatch):
+    monkeypatch.setattr(analyze, "configs_by_key", {})
+
+
+# The shipped -B grid has to load as is: every combination once, and no line overlapping another
+def test_sample_bench_configs(capsys):
+    configs = analyze.read_configs_from_file(os.path.join(HERE, "sample_bench_configs.txt"))
+    assert len(configs) == 4*4*3 + 8 + 3
+    assert len(set([config.key for config in configs])) == len(configs)
+    assert "WARNING" not in capsys.readouterr().err
+
+
+def test_sample_grade_configs():
+    configs = analyze.read_configs_from_file(os.path.join(HERE, "sample_grade_configs.txt"))
+    assert len(set([config.key for config in configs])) == len(configs)
+
+
+# Grids on two lines that share a key: the first line keeps it, the second skips it and says which line had it
+def test_overlapping_grids_skip_with_warning(tmp_path, capsys):
+    grid = tmp_path / "grid.txt"
+    grid.write_text("A   1-2   1   4-8*2   100   5\n"
+                    "B   2     1   8       100   5\n")
+    configs = analyze.read_configs_from_file(str(grid))
+    assert [config.key for config in configs] == ["p1_c1_s4_i100", "p1_c1_s8_i100", "p2_c1_s4_i100", "p2_c1_s8_i100"]
+    assert [config.name for config in configs] == ["A"] * 4
+    err = capsys.readouterr().err
+    assert "'p2_c1_s8_i100' on line 2 is already run by line 1" in err
@@ -0,0 +1,48 @@
+import os
+import pytest
+import analyze
+import latency
+
+
+@pytest.fixture
+def output_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(latency, "LATENCY_DIR", str(tmp_path / "latency"))
+    filename = tmp_path / "CMD-LINE_p2_c2_s4_i3_r1.txt"
+    filename.write_text("1\t1\t1\n2\t2\t2\n3\t1\t2\n")
+    return str(filename)
+
+
+# A -L run: one read/insert/remove stamp per item, written once the output file is closed
+def record_run(output_file):
+    recorder = latency.recorder_object()
+    for item in (1, 2, 3):
+        recorder.reads.append((item,   recorder.start + 10 * item))
+        recorder.inserts.append((item, recorder.start + 10 * item + 3))
+        recorder.removes.append((item, recorder.start + 10 * item + 7))
+    latency.write_latency_file(output_file, recorder)
+
+
+def test_side_file_of_this_run(output_file):
+    record_run(output_file)
+    latency_file = analyze.queued_latency_file(output_file)
+    assert latency_file == latency.latency_filename(output_file)
+    queueing, end_to_end = latency.read_latency_file(latency_file)
+    assert list(queueing) == [4, 4, 4] and list(end_to_end) == [7, 7, 7]
+
+
+# The same config run again without -L rewrites the output file but not the side file, which must not be picked up
+def test_rerun_without_latency_ignores_old_side_file(output_file):
+    record_run(output_file)
+    with open(output_file, 'w') as f:
+        f.write("2\t1\t1\n1\t2\t2\n3\t1\t2\n")
+    stat = os.stat(output_file)
+    os.utime(output_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))    # Same size, so only the mtime tells them apart
+    assert os.path.exists(latency.latency_filename(output_file))
+    assert analyze.queued_latency_file(output_file) is None
+
+
+def test_side_file_without_identity_is_ignored(output_file):
+    os.makedirs(latency.LATENCY_DIR)
+    with open(latency.latency_filename(output_file), 'w') as f:
+        f.write("# item\tread_ns\tinsert_ns\tremove_ns\n1\t10\t13\t17\n")
+    assert analyze.queued_latency_file(output_file) is None
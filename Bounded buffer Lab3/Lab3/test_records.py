@@ -0,0 +1,45 @@
+import pytest
+import records
+
+pytest.importorskip("numpy")             # records.text_blocks is the NumPy block reader
+
+
+# Parity between the two text output parsers: records.text_blocks (mmap blocks, tokenized with NumPy) has to give
+# the same (item, producer, consumer) rows as records.text_row on each line in text mode, which is what analyze
+# falls back to without NumPy.  Each case runs with blocks small enough to split lines across block boundaries too.
+#
+#   python3 -m pytest -q test_records.py
+
+CASES = {
+    "regular":          "1\t1\t1\n2\t2\t1\n4\t1\t2\n3\t2\t2\n",
+    "missing fields":   "1\t1\t1\n7\t1\n8\n3\t\t1\n\n \n2\t2\t2\n",
+    "more than 3":      "1\t1\t1\n9\t1\t1\t1\n-9\t1\t1\t1\n2\t2\t2 5\n3\t3\t3\n",
+    "negative":         "1\t1\t1\n5\t-2\t7\n-0\t1\t1\n-3\t2\t2\n2\t2\t2\n-1\t-1\t-1\n",
+    "overflow":         "1\t1\t1\n12345678901234567890\t1\t1\n-99999999999999999999\t2\t2\n1234567890123456789\t1\t1\n2\t3\t99999999999999999999\n",
+    "unterminated":     "1\t1\t1\n2\t2\t2\n3\t3",
+    "unterminated bad": "1\t1\t1\n2\t2\t2\n9\t1\t1\t1",
+}
+
+BLOCKS = [7, 64, records.TEXT_BLOCK]
+
+
+# What analyze's row loop sees
+def rows_by_line(filename):
+    with open(filename, 'r') as f:
+        return [records.text_row(line) for line in f]
+
+
+def rows_by_block(filename):
+    rows = []
+    for items, prods, conss in records.text_blocks(filename):
+        rows += zip(items.tolist(), prods.tolist(), conss.tolist())
+    return rows
+
+
+@pytest.mark.parametrize("block", BLOCKS)
+@pytest.mark.parametrize("case", list(CASES))
+def test_text_blocks_match_text_row(case, block, tmp_path, monkeypatch):
+    monkeypatch.setattr(records, "TEXT_BLOCK", block)
+    filename = tmp_path / "Test_p2_c2_s4_i3_r1.txt"
+    filename.write_bytes(CASES[case].encode())
+    assert rows_by_block(str(filename)) == rows_by_line(str(filename))
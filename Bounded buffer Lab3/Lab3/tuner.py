@@ -0,0 +1,134 @@
+import os
+import sys
+import shutil
+import tempfile
+import analyze
+import latency
+import runner
+
+
+# Auto-tune (-T): search buffer slots and consumer count for one producer count and item count.
+#
+# Coarse-to-fine hill climbing over (slots, consumers).  Each pass looks at the neighbours of the current best,
+# slots times/divided by the pass's factor and consumers plus/minus its step, and moves to the best neighbour
+# until none of them is better.  Then the next, finer pass starts from there.
+#
+# Each candidate is a regular config_object, run -r times thru runner.run_task and analyzed by run_results_object,
+# so it is scored from exactly what a normal run would report.  Candidates with missing or duplicate items (or a
+# killed run) are never picked.  Candidate output goes to a temp directory that is removed when the search ends (and
+# their -L latency files are removed once scored), so a later -a/-A never grades the probe runs.
+
+GOALS   = {"throughput": "maximize items/sec", "p99": "minimize p99 queueing latency"}
+PASSES  = [(4, 4), (2, 1)]               # (slots factor, consumers step) per pass, coarse to fine
+MIN_SLOTS     = 2
+MAX_SLOTS     = 4096
+MAX_CONSUMERS = 64
+
+
+# One evaluated (slots, consumers) point
+class candidate_object:
+    def __init__(self, num, config, goal):
+        self.num       = num
+        self.config    = config
+        self.slots     = config.slots
+        self.consumers = config.consumers
+        runs           = config.runs
+        wall           = sum([run.timing.wall for run in runs if run.timing])
+        self.items_per_sec = sum([run.items for run in runs]) / wall if wall else 0
+        self.missing   = sum([run.num_missing    for run in runs])
+        self.dups      = sum([run.num_duplicates for run in runs])
+        self.killed    = sum([run.percents.killed.count for run in runs])
+        queueing       = config.queueing()
+        self.p99       = latency.percentiles(queueing)["p99"] if queueing else None
+        self.valid     = self.missing == 0 and self.dups == 0 and self.killed == 0 and (goal != "p99" or self.p99 is not None)
+        self.goal      = goal
+
+    # Bigger is better, invalid candidates always lose
+    def score(self):
+        if not self.valid:                return float("-inf")
+        if self.goal == "throughput":     return self.items_per_sec
+        else:                             return -self.p99
+
+    def as_str(self):
+        p99 = "%10.1fus" % (self.p99 / 1000) if self.p99 is not None else "%12s" % "-"
+        return "c=%-3d s=%-5d items/sec=%12.1f   p99=%s   missing=%-4d dups=%-4d killed=%d%s" % (
+            self.consumers, self.slots, self.items_per_sec, p99, self.missing, self.dups, self.killed, "" if self.valid else "   <<< rejected")
+
+
+class tuner_object:
+    def __init__(self, goal, producers, items, timeout, runs, input_file, output_dir, targets_for, options, ext):
+        self.goal        = goal
+        self.producers   = producers
+        self.items       = items
+        self.timeout     = timeout
+        self.runs        = runs
+        self.input_file  = input_file
+        self.output_dir  = output_dir
+        self.targets_for = targets_for   # buffer.py's targets_for(config), so engine choice and checks match a normal run
+        self.options     = options
+        self.ext         = ext           # Output file extension (-F)
+        self.tried       = {}            # (slots, consumers) -> candidate_object, each point is only run once
+        self.trace       = []            # candidates in the order they were run
+
+    def evaluate(self, slots, consumers):
+        if (slots, consumers) in self.tried: return self.tried[(slots, consumers)]
+        key    = analyze.config_key(self.producers, consumers, slots, self.items)
+        if key in analyze.configs_by_key: config = analyze.configs_by_key[key]     # e.g., the starting point is also the command line config
+        else:                             config = analyze.config_object("Tune", self.producers, consumers, slots, self.items, self.timeout)
+        engine, p_target, c_target = self.targets_for(config)
+        for run in range(1, self.runs+1):
+            output_file = config.filename(self.output_dir, run, self.ext)
+            task = runner.run_task_object(config, run, len(self.trace)+1, engine, p_target, c_target,
+                                          self.input_file, output_file, self.options, analyze.TARGET_OOO)
+            runner.run_task(task)                                # Runs and analyzes into config, the printed detail is dropped
+            try:            os.remove(latency.latency_filename(output_file))    # Already read into config, if -L wrote one
+            except OSError: pass
+        candidate = candidate_object(len(self.trace)+1, config, self.goal)
+        self.tried[(slots, consumers)] = candidate
+        self.trace.append(candidate)
+        print("%s %s" % (analyze.label("Tune-%d" % candidate.num), candidate.as_str()))
+        sys.stdout.flush()
+        return candidate
+
+    def neighbours(self, best, factor, step):
+        points = []
+        for slots in (best.slots // factor, best.slots, best.slots * factor):
+            for consumers in (best.consumers - step, best.consumers, best.consumers + step):
+                if MIN_SLOTS <= slots <= MAX_SLOTS and 1 <= consumers <= MAX_CONSUMERS and (slots, consumers) != (best.slots, best.consumers):
+                    points.append((slots, consumers))
+        return points
+
+    def search(self, slots, consumers):
+        best = self.evaluate(slots, consumers)
+        for factor, step in PASSES:
+            print("%s slots *,/ %d, consumers +/- %d, from c=%d s=%d" % (analyze.label("Tune pass"), factor, step, best.consumers, best.slots))
+            moved = True
+            while moved:
+                moved = False
+                for point in self.neighbours(best, factor, step):
+                    candidate = self.evaluate(*point)
+                    if candidate.score() > best.score():
+                        best  = candidate
+                        moved = True
+        return best
+
+
+# Entry point for buffer.py -T.  Starts from the -s/-c given on the command line.
+def tune(goal, producers, consumers, slots, items, timeout, runs, input_file, targets_for, options, ext):
+    print("\n%s goal=%s (%s)   p=%d   i=%d   runs per candidate=%d   start c=%d s=%d" % (analyze.label("Auto-tune"), goal, GOALS[goal], producers, items, runs, consumers, slots))
+    work  = tempfile.mkdtemp(prefix="tune_")                  # Candidate output, not output/ where -a/-A would grade it
+    try:
+        tuner = tuner_object(goal, producers, items, timeout, runs, input_file, work, targets_for, options, ext)
+        best  = tuner.search(slots, consumers)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    print("\n%s %d candidates" % (analyze.label("Search trace"), len(tuner.trace)))
+    for candidate in tuner.trace:
+        print("    %-4d %s%s" % (candidate.num, candidate.as_str(), "   <<< BEST" if candidate is best else ""))
+
+    if not best.valid:
+        print("\nERROR: No candidate ran without missing/duplicate items.  Try a longer -t or another engine.\n", file=sys.stderr)
+        return None
+    print("\n%s -p %d -c %d -s %d -i %d   %s" % (analyze.label("Best config"), producers, best.consumers, best.slots, items, best.as_str()))
+    return best
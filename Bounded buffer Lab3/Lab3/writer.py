@@ -0,0 +1,77 @@
+import time
+import threading
+import collections
+import itertools
+import struct
+
+
+# Dedicated output writer stage (-W).
+#
+# Consumers hand each record to put() while they still hold consumer_buffer, right after taking the item out of the
+# buffer.  put() is the deque's append (atomic, no lock), and since it happens inside the buffer critical section the
+# deque is in consumption order.  One writer thread empties the deque in blocks, formats them (text or binary records)
+# and writes each block with a single write call, so consumers never take consumer_file_out or touch the file.
+#
+# write() still works for code that formats its own lines (student code, the wrapper's KILL line); the text is queued
+# in order behind everything already handed off.  flush() waits until everything queued so far is on disk, which is
+# what kill_buffer needs for its '-1 -1 -1' line.
+
+WRITER_POLL  = 0.001                 # Seconds the writer sleeps when there's nothing to write
+WRITER_BLOCK = 65536                 # Max records formatted and written per write call
+
+
+class writer_stage:
+    def __init__(self, f_out):
+        self.f_out   = f_out
+        self.queue   = collections.deque()
+        self.lock    = threading.Lock()                      # Only between the writer thread and flush()/close(), never a consumer
+        self.pack    = getattr(f_out, "pack_record", None)    # Binary output (-F bin) gets packed records
+        self.done    = False
+        self.put     = self.queue.append                      # Consumers call put((item, producer_num, consumer_num)), straight into the deque
+        self.thread  = threading.Thread(target=self.run, name="Writer", daemon=True)
+        self.thread.start()
+
+    def write(self, text):
+        self.queue.append(text)
+
+    # Format and write whatever is queued, in blocks, in order.  Pre-formatted text (from write()) keeps its place.
+    def drain(self):
+        popleft = self.queue.popleft
+        while self.queue:
+            block = [popleft() for i in range(min(len(self.queue), WRITER_BLOCK))]
+            if not self.pack:
+                self.f_out.write(''.join([record if record.__class__ is str else '%d\t%d\t%d\n' % record for record in block]))
+                continue
+            start = 0
+            for i, record in enumerate(block):                  # Binary output: pack runs of records, hand text to the binary handle as is
+                if record.__class__ is str:
+                    self.emit(block[start:i])
+                    self.f_out.write(record)
+                    start = i + 1
+            self.emit(block[start:])
+
+    def emit(self, block):
+        if block: self.f_out.write(struct.pack('<%di' % (3 * len(block)), *itertools.chain.from_iterable(block)))
+
+    def run(self):
+        while not self.done:
+            if self.queue:
+                with self.lock: self.drain()
+            else:
+                time.sleep(WRITER_POLL)
+
+    def flush(self):
+        with self.lock:
+            self.drain()
+            self.f_out.flush()
+
+    def fileno(self):
+        return self.f_out.fileno()
+
+    # Called once every consumer is done (or abandoned).  Anything a late consumer puts after this is dropped, same as
+    # a write to a closed file.
+    def close(self):
+        self.done = True
+        self.thread.join()
+        self.flush()
+        self.f_out.close()